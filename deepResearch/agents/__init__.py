@@ -1,7 +1,22 @@
-"""AI Agents for Deep Research."""
+"""AI Agents for Deep Research.
 
-from .planner import PlannerAgent
-from .searcher import SearcherAgent
-from .analyzer import AnalyzerAgent
+Agents are imported on first access so that importing one agent module does
+not pull in the others.
+"""
+
+import importlib
+
+_AGENT_MODULES = {
+    "PlannerAgent": ".planner",
+    "SearcherAgent": ".searcher",
+    "AnalyzerAgent": ".analyzer",
+}
 
 __all__ = ["PlannerAgent", "SearcherAgent", "AnalyzerAgent"]
+
+
+def __getattr__(name):
+    if name in _AGENT_MODULES:
+        module = importlib.import_module(_AGENT_MODULES[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
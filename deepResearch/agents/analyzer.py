@@ -1,10 +1,8 @@
-import os
 from typing import List, Optional
 from pydantic import BaseModel, Field
-from pydantic_ai import Agent
 
 from models.schemas import SearchResult, FragranceRecommendation
-from config import get_model_config
+from .hedging import HedgedAgent
 
 
 class RecommendationOutput(BaseModel):
@@ -43,11 +41,8 @@ class AnalyzerAgent:
     """Agent that synthesizes search results into fragrance recommendations."""
 
     def __init__(self):
-        model_string, env_key, api_key = get_model_config()
-        os.environ[env_key] = api_key
-
-        self.agent = Agent(
-            model_string,
+        self.agent = HedgedAgent(
+            "analyze",
             instructions=ANALYZER_INSTRUCTIONS,
             output_type=AnalysisOutput,
         )
@@ -0,0 +1,174 @@
+"""Hedged LLM calls with failover to a secondary provider.
+
+When LLM_HEDGE_PROVIDER is set, each agent also builds a copy of itself on
+that provider. A call that outlives the LLM_HEDGE_PERCENTILE of recent
+calls of the same kind is duplicated to the secondary provider. The first
+successful answer wins and the other request is cancelled. A call that
+fails on the primary provider fails over to the secondary straight away.
+
+Until a kind has enough samples, LLM_HEDGE_DELAY_MS is the hedge delay.
+
+Only primary calls that actually finished are latency samples. A primary
+cancelled because the hedge won only tells us it would have taken longer,
+so it is counted as censored and kept out of the hedge delay percentile
+and of p99_primary_ms. Those are therefore a lower bound whenever
+primary_censored is non-zero.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from pydantic_ai import Agent
+
+import config
+from config import get_agent_model
+from .ratelimit import run_agent
+
+MIN_SAMPLES = 20
+WINDOW = 500
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1]
+
+
+class HedgeMetrics:
+    """Hedge rate and tail latency, per call kind and overall."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._primary: Dict[str, deque] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._primary.clear()
+            self.calls = 0
+            self.hedged = 0
+            self.hedge_wins = 0
+            self.failovers = 0
+            # latency callers saw, and the latency of primaries that finished
+            self.observed = deque(maxlen=WINDOW)
+            self.primary = deque(maxlen=WINDOW)
+            # elapsed time of cancelled primaries, each a lower bound on that call's latency
+            self.censored = deque(maxlen=WINDOW)
+            self.primary_censored = 0
+
+    def hedge_delay(self, kind: str) -> float:
+        """Seconds to wait on the primary before hedging a call of this kind."""
+        with self._lock:
+            samples = list(self._primary.get(kind, ()))
+        if len(samples) < MIN_SAMPLES:
+            return config.LLM_HEDGE_DELAY_MS / 1000
+        return _percentile(samples, config.LLM_HEDGE_PERCENTILE)
+
+    def record(self, kind: str, observed: float, primary: Optional[float],
+               hedged: bool, hedge_won: bool, failover: bool, censored: Optional[float] = None) -> None:
+        """Record one call. primary is set only if the primary finished, censored if it was cancelled."""
+        with self._lock:
+            self.calls += 1
+            self.hedged += hedged
+            self.hedge_wins += hedge_won
+            self.failovers += failover
+            self.observed.append(observed)
+            if primary is not None:
+                self.primary.append(primary)
+                self._primary.setdefault(kind, deque(maxlen=WINDOW)).append(primary)
+            if censored is not None:
+                self.censored.append(censored)
+                self.primary_censored += 1
+
+    def snapshot(self) -> dict:
+        def ms(values, q):
+            value = _percentile(values, q)
+            return round(value * 1000, 1) if value is not None else None
+
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "p50_ms": ms(self.observed, 50),
+                "p99_ms": ms(self.observed, 99),
+                "p99_primary_ms": ms(self.primary, 99),
+                "primary_censored": self.primary_censored,
+            }
+
+
+metrics = HedgeMetrics()
+
+
+class HedgedAgent:
+    """A pydantic_ai agent on the configured provider, hedged to a secondary provider if set."""
+
+    def __init__(self, kind: str, **agent_kwargs):
+        self.kind = kind
+        self.primary = Agent(get_agent_model(), **agent_kwargs)
+        self.secondary = None
+
+        hedge_provider = config.LLM_HEDGE_PROVIDER
+        if hedge_provider and hedge_provider != config.LLM_PROVIDER:
+            try:
+                self.secondary = Agent(get_agent_model(hedge_provider), **agent_kwargs)
+            except ValueError as e:
+                print(f"Hedging disabled for {kind}: {e}")
+
+    async def run(self, prompt: str):
+        """Run the prompt, hedging or failing over to the secondary provider if needed."""
+        start = time.monotonic()
+        if self.secondary is None:
+            result = await run_agent(self.primary, prompt)
+            elapsed = time.monotonic() - start
+            metrics.record(self.kind, elapsed, elapsed, hedged=False, hedge_won=False, failover=False)
+            return result
+
+        primary = asyncio.ensure_future(run_agent(self.primary, prompt))
+        secondary = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=metrics.hedge_delay(self.kind))
+            if done and primary.exception() is None:
+                elapsed = time.monotonic() - start
+                metrics.record(self.kind, elapsed, elapsed, hedged=False, hedge_won=False, failover=False)
+                return primary.result()
+
+            # slow or failed: send the same call to the secondary provider
+            failover = bool(done)
+            secondary = asyncio.ensure_future(
+                run_agent(self.secondary, prompt, provider=config.LLM_HEDGE_PROVIDER)
+            )
+            pending = {secondary} if failover else {primary, secondary}
+            errors = [primary.exception()] if failover else []
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+
+                    elapsed = time.monotonic() - start
+                    for loser in pending:
+                        loser.cancel()
+                    hedge_won = task is secondary
+                    # a failed primary has no latency; a cancelled one only a lower bound
+                    primary_cancelled = hedge_won and primary in pending
+                    metrics.record(self.kind, elapsed, None if hedge_won else elapsed, hedged=True,
+                                   hedge_won=hedge_won, failover=failover,
+                                   censored=elapsed if primary_cancelled else None)
+                    return task.result()
+
+            raise errors[0]
+        finally:
+            for task in (primary, secondary):
+                if task is not None and not task.done():
+                    task.cancel()
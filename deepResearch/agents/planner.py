@@ -1,12 +1,10 @@
 """Planner Agent - Creates search plan from fragrance notes using pydantic_ai."""
 
-import os
 from typing import List
 from pydantic import BaseModel, Field
-from pydantic_ai import Agent
 
 from models.schemas import ResearchPlan, SearchTask
-from config import get_model_config
+from .hedging import HedgedAgent
 
 
 class PlanOutput(BaseModel):
@@ -37,12 +35,9 @@ class PlannerAgent:
     """Agent that creates a research plan from user's fragrance preferences."""
 
     def __init__(self):
-        model_string, env_key, api_key = get_model_config()
-        os.environ[env_key] = api_key
-
         # create agent with structured output
-        self.agent = Agent(
-            model_string,
+        self.agent = HedgedAgent(
+            "plan",
             instructions=PLANNER_INSTRUCTIONS,
             output_type=PlanOutput,
         )
@@ -0,0 +1,207 @@
+"""Process-wide rate limiting and 429 backoff for LLM provider calls.
+
+Every research task runs on its own thread and event loop, so the limiter
+is built on threading primitives and hands out turns to asyncio waiters
+across loops. Each provider gets two token buckets (requests and tokens per
+minute) and a FIFO queue, so tasks are served in arrival order instead of
+racing each other into the provider's limit.
+
+A 429 from the provider drains the request bucket, halves the refill rate
+(recovering additively on success) and is retried with jittered
+exponential backoff.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from pydantic_ai.exceptions import ModelHTTPError
+
+import config
+
+# prompt tokens are estimated from characters, plus room for instructions and output
+CHARS_PER_TOKEN = 4
+CALL_OVERHEAD_TOKENS = 600
+
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+MIN_RATE_SCALE = 0.1
+RATE_RECOVERY_STEP = 0.05
+
+
+class TokenBucket:
+    """Refills at rate_per_minute up to a full minute's worth. Not thread-safe."""
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, scale: float = 1.0) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate * scale)
+        self.updated = now
+
+    def wait_time(self, amount: float, scale: float = 1.0) -> float:
+        """Seconds until `amount` is available, 0 if it already is."""
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / (self.rate * scale)
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class ProviderLimiter:
+    """FIFO request/token limiter for one provider, shared across threads and loops."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.scale = 1.0
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self.rate_limited = 0
+
+    def _wake_head(self) -> None:
+        """Tell the waiter at the head of the queue it may take its turn. Lock held."""
+        while self._queue:
+            loop, waiter = self._queue[0]
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+                return
+            except RuntimeError:
+                # the waiter's loop has closed, skip it
+                self._queue.popleft()
+
+    def _try_take(self, tokens: float) -> float:
+        """Take a request and tokens if both are available, else return the wait. Lock held."""
+        self.requests.refill(self.scale)
+        self.tokens.refill(self.scale)
+        wait = max(self.requests.wait_time(1, self.scale), self.tokens.wait_time(tokens, self.scale))
+        if wait <= 0:
+            self.requests.take(1)
+            self.tokens.take(tokens)
+        return wait
+
+    async def acquire(self, tokens: float) -> None:
+        """Wait for this caller's turn in the queue and for bucket capacity."""
+        loop = asyncio.get_running_loop()
+        entry = (loop, loop.create_future())
+        with self._lock:
+            self._queue.append(entry)
+            if self._queue[0] is entry:
+                _resolve(entry[1])
+
+        try:
+            await entry[1]
+            while True:
+                with self._lock:
+                    wait = self._try_take(tokens)
+                    if wait <= 0:
+                        self._queue.popleft()
+                        self._wake_head()
+                        return
+                await asyncio.sleep(wait)
+        except BaseException:
+            # cancelled while queued or waiting: give up the place in line
+            with self._lock:
+                was_head = bool(self._queue) and self._queue[0] is entry
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                if was_head:
+                    self._wake_head()
+            raise
+
+    def record_usage(self, estimated: float, actual: Optional[int]) -> None:
+        """Charge the token bucket for the difference between estimate and actual usage."""
+        if actual is None:
+            return
+        with self._lock:
+            self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + estimated - actual)
+
+    def on_rate_limited(self) -> None:
+        """Back off the whole process after a 429."""
+        with self._lock:
+            self.rate_limited += 1
+            self.scale = max(MIN_RATE_SCALE, self.scale / 2)
+            self.requests.refill(self.scale)
+            self.requests.tokens = min(self.requests.tokens, 0.0)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.scale = min(1.0, self.scale + RATE_RECOVERY_STEP)
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str = None) -> ProviderLimiter:
+    """Get the process-wide limiter for a provider (the configured one by default)."""
+    provider = provider or config.LLM_PROVIDER
+    with _limiters_lock:
+        if provider not in _limiters:
+            requests_per_minute, tokens_per_minute = config.RATE_LIMITS.get(provider, (60, 100000))
+            _limiters[provider] = ProviderLimiter(requests_per_minute, tokens_per_minute)
+        return _limiters[provider]
+
+
+def estimate_tokens(prompt: str) -> int:
+    return len(prompt) // CHARS_PER_TOKEN + CALL_OVERHEAD_TOKENS
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff, never shorter than the provider's Retry-After."""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _retry_after(error: ModelHTTPError) -> Optional[float]:
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _total_tokens(result) -> Optional[int]:
+    # usage is a method on older pydantic_ai releases and a property on newer ones
+    usage = result.usage
+    usage = usage() if callable(usage) else usage
+    return getattr(usage, "total_tokens", None)
+
+
+async def run_agent(agent, prompt: str, provider: str = None, max_retries: int = None):
+    """Run a pydantic_ai agent under the provider's limiter, retrying 429s."""
+    limiter = get_limiter(provider)
+    max_retries = config.LLM_MAX_RETRIES if max_retries is None else max_retries
+    estimate = estimate_tokens(prompt)
+
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(estimate)
+        try:
+            result = await agent.run(prompt)
+        except ModelHTTPError as e:
+            if e.status_code != 429 or attempt == max_retries:
+                raise
+            limiter.on_rate_limited()
+            await asyncio.sleep(backoff_delay(attempt, _retry_after(e)))
+            continue
+
+        limiter.on_success()
+        limiter.record_usage(estimate, _total_tokens(result))
+        return result
@@ -1,19 +1,26 @@
 """Searcher Agent - Executes web searches and summarizes results using pydantic_ai."""
 
 import asyncio
-import os
 from typing import List
-from pydantic_ai import Agent
 
 from models.schemas import SearchTask, SearchResult
-from config import get_model_config
+from .hedging import HedgedAgent
 
-# using DuckDuckGo search, no API key required
-try:
-    from duckduckgo_search import DDGS
-    HAS_DDGS = True
-except ImportError:
-    HAS_DDGS = False
+# using DuckDuckGo search, no API key required. imported on the first search
+DDGS = None
+HAS_DDGS = None
+
+
+def _load_ddgs() -> bool:
+    """Import DuckDuckGo search once. Returns whether it is available."""
+    global DDGS, HAS_DDGS
+    if HAS_DDGS is None:
+        try:
+            from duckduckgo_search import DDGS
+            HAS_DDGS = True
+        except ImportError:
+            HAS_DDGS = False
+    return HAS_DDGS
 
 
 SUMMARIZER_INSTRUCTIONS = """You are a perfume expert analyzing search results.
@@ -31,10 +38,7 @@ class SearcherAgent:
     """Agent that executes web searches and summarizes results."""
 
     def __init__(self):
-        model_string, env_key, api_key = get_model_config()
-        os.environ[env_key] = api_key
-
-        self.summarizer = Agent(model_string, instructions=SUMMARIZER_INSTRUCTIONS, output_type=str)
+        self.summarizer = HedgedAgent("summarize", instructions=SUMMARIZER_INSTRUCTIONS, output_type=str)
 
     async def execute_searches(self, tasks: List[SearchTask]) -> List[SearchResult]:
         """Execute all searches in parallel."""
@@ -75,7 +79,7 @@ Summarize the perfume-related information found."""
 
     async def _web_search(self, query: str, max_results: int = 8) -> List[dict]:
         """Perform web search using DuckDuckGo."""
-        if not HAS_DDGS:
+        if not _load_ddgs():
             return [{
                 "title": f"Search result for: {query}",
                 "body": "DuckDuckGo search not available. Install with: pip install duckduckgo-search",
@@ -1,9 +1,26 @@
 """Configuration for Deep Research service."""
 
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+
+def _find_env_file():
+    """The nearest .env from this directory upwards, where load_dotenv() would look."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        candidate = os.path.join(directory, ".env")
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+# only pay for python-dotenv when there is a .env file to read
+_ENV_FILE = _find_env_file()
+if _ENV_FILE:
+    from dotenv import load_dotenv
+    load_dotenv(_ENV_FILE)
 
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
 
@@ -13,22 +30,69 @@ GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY", "")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 
+# provider rate limits shared by every task in the process (requests and tokens per minute)
+RATE_LIMITS = {
+    "groq": (int(os.getenv("GROQ_RPM", "30")), int(os.getenv("GROQ_TPM", "12000"))),
+    "gemini": (int(os.getenv("GEMINI_RPM", "15")), int(os.getenv("GEMINI_TPM", "1000000"))),
+}
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+
+# optional hedging: an LLM call slower than the given percentile of recent calls
+# is duplicated to this provider and the first answer wins ("" disables it)
+LLM_HEDGE_PROVIDER = os.getenv("LLM_HEDGE_PROVIDER", "")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_DELAY_MS = float(os.getenv("LLM_HEDGE_DELAY_MS", "3000"))
+
+# completed research is reused for identical requests for this long
+RESEARCH_CACHE_TTL_HOURS = float(os.getenv("RESEARCH_CACHE_TTL_HOURS", "24"))
+# researched recommendations for warm-up, kept apart from the query log (next to it by default)
+_QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "")
+RESEARCH_RESULTS_PATH = os.getenv("RESEARCH_RESULTS_PATH") or (
+    os.path.splitext(_QUERY_LOG_PATH)[0] + ".results.jsonl" if _QUERY_LOG_PATH else ""
+)
+
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "5001"))
 
 
-def get_model_config():
-    """Get the model string and API key based on configured provider."""
-    if LLM_PROVIDER == "groq":
+def get_model_config(provider: str = None):
+    """Get the model string and API key for a provider (the configured one by default)."""
+    provider = provider or LLM_PROVIDER
+    if provider == "groq":
         if not GROQ_API_KEY:
             raise ValueError("GROQ_API_KEY required. Get free key at https://console.groq.com")
         return f"groq:{GROQ_MODEL}", "GROQ_API_KEY", GROQ_API_KEY
-    elif LLM_PROVIDER == "gemini":
+    elif provider == "gemini":
         if not GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY required for Gemini provider.")
         return f"google-gla:{GEMINI_MODEL}", "GEMINI_API_KEY", GEMINI_API_KEY
     else:
-        raise ValueError(f"Unknown LLM_PROVIDER: {LLM_PROVIDER}. Use 'groq' or 'gemini'")
+        raise ValueError(f"Unknown LLM_PROVIDER: {provider}. Use 'groq' or 'gemini'")
+
+
+# local pydantic_ai models that replace providers, for tests and load testing.
+# the None key applies to every provider without its own override
+_model_overrides = {}
+
+
+def set_model_override(model, provider: str = None):
+    """Route agents to a local pydantic_ai model (None restores the provider)."""
+    if model is None:
+        _model_overrides.pop(provider, None)
+    else:
+        _model_overrides[provider] = model
+
+
+def get_agent_model(provider: str = None):
+    """Get the model to build an agent with, exporting its API key."""
+    provider = provider or LLM_PROVIDER
+    override = _model_overrides.get(provider, _model_overrides.get(None))
+    if override is not None:
+        return override
+
+    model_string, env_key, api_key = get_model_config(provider)
+    os.environ[env_key] = api_key
+    return model_string
 
 
 def validate_config():
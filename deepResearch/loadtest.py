@@ -0,0 +1,426 @@
+"""
+Load test harness for the research pipeline ~~~~ no provider quota required.
+
+Runs the server in a child process with local stubs in place of the LLM
+provider (a pydantic_ai FunctionModel) and DuckDuckGo (a fake DDGS), each
+with a configurable lognormal latency and error rate. Research tasks are
+started at a target Poisson arrival rate over HTTP and polled until they
+finish.
+
+Reports tasks/sec, end-to-end p50/p99 and the growth of the server's
+threads and memory over the run, sampled from /proc/<pid> of the server
+process alone so the client threads are not counted.
+
+With --hedge-provider, a second stub provider is installed and LLM calls
+are hedged to it. The same load, with the same seed, is first run with
+hedging off. The report then compares the two runs' p99 LLM call latency
+and end-to-end p99. Both latencies are measured around the whole call,
+including 429 backoff and retries.
+
+usage: python loadtest.py --rate 5 --duration 30 --llm-latency-ms 800 --llm-error-rate 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import FunctionModel
+from werkzeug.serving import make_server
+
+import config
+from agents import searcher
+from agents.hedging import metrics as hedge_metrics
+from agents.ratelimit import get_limiter
+
+TERMINAL_STATUSES = {"completed", "failed", "cancelled"}
+
+# options passed on to the server process, which installs the stubs
+SERVER_OPTIONS = (
+    "llm_latency_ms", "llm_sigma", "llm_error_rate",
+    "search_latency_ms", "search_sigma", "search_error_rate",
+    "rpm", "tpm", "hedge_provider", "hedge_latency_ms", "hedge_sigma", "hedge_delay_ms", "seed",
+)
+LISTENING = "listening on port "
+
+
+class Latency:
+    """Lognormal latency with a given median; sigma=0 gives a constant delay."""
+
+    def __init__(self, median_ms: float, sigma: float, rng: random.Random):
+        self.mu = math.log(max(median_ms, 1e-3) / 1000)
+        self.sigma = sigma
+        self.rng = rng
+
+    def sample(self) -> float:
+        return self.rng.lognormvariate(self.mu, self.sigma)
+
+
+def _stub_output(properties: dict) -> dict:
+    """Canned structured output for the planner or analyzer output tool."""
+    if "search_tasks" in properties:
+        return {
+            "search_tasks": [
+                {"query": f"stub perfume search {i}", "focus": "fragrance notes match"}
+                for i in range(3)
+            ],
+            "reasoning": "stub plan",
+        }
+    return {
+        "recommendations": [
+            {
+                "Name": f"Stub Perfume {i}",
+                "Brand": "Stub House",
+                "Notes": "vanilla, musk, amber",
+                "reasoning": "stub recommendation",
+            }
+            for i in range(3)
+        ]
+    }
+
+
+def make_stub_model(latency: Latency, error_rate: float, rng: random.Random) -> FunctionModel:
+    """A FunctionModel that answers every agent after a sampled delay."""
+
+    async def respond(messages, info):
+        await asyncio.sleep(latency.sample())
+        if rng.random() < error_rate:
+            raise ModelHTTPError(429, "stub", {"error": "stub rate limit"})
+
+        if info.output_tools:
+            tool = info.output_tools[0]
+            properties = tool.parameters_json_schema.get("properties", {})
+            return ModelResponse(parts=[ToolCallPart(tool.name, _stub_output(properties))])
+        return ModelResponse(parts=[TextPart("Stub Perfume 1 by Stub House: vanilla, musk.")])
+
+    return FunctionModel(respond, model_name="stub")
+
+
+def make_stub_ddgs(latency: Latency, error_rate: float, rng: random.Random):
+    """A DDGS replacement with the same context manager and text() interface."""
+
+    class StubDDGS:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def text(self, query, max_results=8):
+            time.sleep(latency.sample())
+            if rng.random() < error_rate:
+                raise RuntimeError("stub search error")
+            return [
+                {"title": f"{query} result {i}", "body": "vanilla, musk", "href": "https://example.com"}
+                for i in range(max_results)
+            ]
+
+    return StubDDGS
+
+
+def install_stubs(args, rng: random.Random):
+    """Swap the provider and DuckDuckGo for stubs. Returns a function that restores them."""
+    saved = (searcher.DDGS, searcher.HAS_DDGS)
+
+    config.set_model_override(make_stub_model(
+        Latency(args.llm_latency_ms, args.llm_sigma, rng), args.llm_error_rate, rng
+    ))
+    searcher.DDGS = make_stub_ddgs(
+        Latency(args.search_latency_ms, args.search_sigma, rng), args.search_error_rate, rng
+    )
+    searcher.HAS_DDGS = True
+
+    # the shared limiter reads these when it is first used
+    saved_limits = dict(config.RATE_LIMITS)
+    config.RATE_LIMITS[config.LLM_PROVIDER] = (args.rpm, args.tpm)
+
+    saved_hedge = (config.LLM_HEDGE_PROVIDER, config.LLM_HEDGE_DELAY_MS)
+    if args.hedge_provider:
+        config.LLM_HEDGE_PROVIDER = args.hedge_provider
+        config.RATE_LIMITS[args.hedge_provider] = (args.rpm, args.tpm)
+        config.set_model_override(make_stub_model(
+            Latency(args.hedge_latency_ms, args.hedge_sigma, rng), args.llm_error_rate, rng
+        ), args.hedge_provider)
+        if args.hedge_delay_ms is not None:
+            config.LLM_HEDGE_DELAY_MS = args.hedge_delay_ms
+
+    def restore():
+        config.set_model_override(None)
+        config.set_model_override(None, args.hedge_provider or None)
+        config.LLM_HEDGE_PROVIDER, config.LLM_HEDGE_DELAY_MS = saved_hedge
+        searcher.DDGS, searcher.HAS_DDGS = saved
+        config.RATE_LIMITS.update(saved_limits)
+
+    return restore
+
+
+def process_stats(pid: int):
+    """(threads, rss bytes) of a process from /proc, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["Threads"]), int(fields["VmRSS"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def percentile(values, q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class ResourceMonitor:
+    """Samples the thread count and RSS of the server process in the background."""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        stats = process_stats(self.pid)
+        if stats is not None:
+            self.samples.append(stats)
+
+    def _run(self):
+        while True:
+            self._sample()
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def _request(url: str, body: dict = None) -> dict:
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read())
+
+
+def run_one(base_url: str, poll_interval: float, timeout: float, preferences: str) -> dict:
+    """Start one research task and poll it until it finishes."""
+    start = time.perf_counter()
+    try:
+        task_id = _request(f"{base_url}/api/research/start",
+                           {"notes": ["vanilla", "musk"], "preferences": preferences})["task_id"]
+    except Exception as e:
+        return {"status": "start_error", "error": str(e), "latency": time.perf_counter() - start}
+
+    status = "timeout"
+    polls = 0
+    while time.perf_counter() - start < timeout:
+        time.sleep(poll_interval)
+        polls += 1
+        try:
+            status = _request(f"{base_url}/api/research/status/{task_id}")["status"]
+        except Exception:
+            status = "poll_error"
+            continue
+        if status in TERMINAL_STATUSES:
+            break
+
+    return {"status": status, "latency": time.perf_counter() - start, "polls": polls}
+
+
+def serve(args):
+    """Run the stubbed server (the child process side of run_load) until terminated."""
+    install_stubs(args, random.Random(args.seed))
+
+    import server  # imported after the stubs so nothing reaches a real provider
+
+    @server.app.route("/loadtest/stats", methods=["GET"])
+    def loadtest_stats():
+        return {
+            "tracked_background_tasks": len(server._background_tasks),
+            "provider_429s": get_limiter().rate_limited,
+            "research_cache_hits": server.research_cache.hits,
+            "llm_calls": hedge_metrics.snapshot(),
+        }
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    http = make_server("127.0.0.1", 0, server.app, threaded=True)
+    print(f"{LISTENING}{http.server_port}", flush=True)
+    # nobody reads stdout past the port, send anything the server prints to stderr
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    http.serve_forever()
+
+
+def start_server(args) -> tuple:
+    """Start the stubbed server in a child process. Returns (process, base url)."""
+    command = [sys.executable, os.path.abspath(__file__), "--serve"]
+    for name in SERVER_OPTIONS:
+        value = getattr(args, name)
+        if value is not None and value != "":
+            command += [f"--{name.replace('_', '-')}", str(value)]
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith(LISTENING):
+        process.kill()
+        raise RuntimeError(f"load test server failed to start (exit code {process.wait()})")
+    return process, f"http://127.0.0.1:{int(line[len(LISTENING):])}"
+
+
+def run_load(args) -> dict:
+    """Drive the stubbed server at the target rate and collect a report."""
+    process, base_url = start_server(args)
+    monitor = ResourceMonitor(process.pid)
+    monitor.start()
+
+    results = []
+    arrivals = random.Random(args.seed + 1)
+    run_start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.max_clients) as clients:
+            futures = []
+            next_arrival = run_start
+            while next_arrival - run_start < args.duration:
+                time.sleep(max(0.0, next_arrival - time.perf_counter()))
+                # distinct requests miss the research cache unless --distinct-queries repeats them
+                query = arrivals.randrange(args.distinct_queries) if args.distinct_queries else len(futures)
+                futures.append(clients.submit(run_one, base_url, args.poll_interval, args.timeout,
+                                              f"load test {query}"))
+                next_arrival += arrivals.expovariate(args.rate)
+            results = [f.result() for f in futures]
+        elapsed = time.perf_counter() - run_start
+        stats = _request(f"{base_url}/loadtest/stats")
+    finally:
+        monitor.stop()
+        process.terminate()
+        process.wait()
+
+    completed = [r["latency"] for r in results if r["status"] == "completed"]
+    statuses = {}
+    for r in results:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+
+    def growth(values):
+        return {"start": values[0], "peak": max(values), "end": values[-1]} if values else None
+
+    rss_mb = [round(m / 2**20, 1) for _, m in monitor.samples]
+    return {
+        "offered_rate": args.rate,
+        "started": len(results),
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "tasks_per_sec": round(len(completed) / elapsed, 3) if elapsed else 0.0,
+        "e2e_p50_s": round(percentile(completed, 50), 3),
+        "e2e_p99_s": round(percentile(completed, 99), 3),
+        "server_pid": process.pid,
+        "threads": growth([t for t, _ in monitor.samples]),
+        "rss_mb": growth(rss_mb),
+        **stats,
+    }
+
+
+def compare_hedging(args) -> dict:
+    """Run the load with hedging off, then as configured. Returns the hedged report with a baseline."""
+    baseline = run_load(argparse.Namespace(**{**vars(args), "hedge_provider": ""}))
+    report = run_load(args)
+    report["baseline"] = {
+        "e2e_p99_s": baseline["e2e_p99_s"],
+        "llm_p99_ms": baseline["llm_calls"]["p99_ms"],
+        "provider_429s": baseline["provider_429s"],
+    }
+    return report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Load test the research pipeline with stub backends.")
+    parser.add_argument("--rate", type=float, default=2.0, help="task arrivals per second")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to keep arriving")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-task deadline in seconds")
+    parser.add_argument("--max-clients", type=int, default=256)
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0, help="median LLM call latency")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="lognormal sigma of LLM latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--search-latency-ms", type=float, default=300.0)
+    parser.add_argument("--search-sigma", type=float, default=0.5)
+    parser.add_argument("--search-error-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, default=1e6, help="provider requests/minute for the limiter")
+    parser.add_argument("--tpm", type=float, default=1e9, help="provider tokens/minute for the limiter")
+    parser.add_argument("--hedge-provider", default="",
+                        help="hedge LLM calls to a second stub provider under this name (e.g. gemini)")
+    parser.add_argument("--hedge-latency-ms", type=float, default=800.0, help="median latency of the hedge provider")
+    parser.add_argument("--hedge-sigma", type=float, default=0.5)
+    parser.add_argument("--hedge-delay-ms", type=float, default=None,
+                        help="hedge delay until enough samples are seen (LLM_HEDGE_DELAY_MS by default)")
+    parser.add_argument("--no-baseline", action="store_true",
+                        help="with --hedge-provider, skip the comparison run with hedging off")
+    parser.add_argument("--distinct-queries", type=int, default=0,
+                        help="draw requests from this many distinct queries (0: every request is new)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    if args.hedge_provider and not args.no_baseline:
+        report = compare_hedging(args)
+    else:
+        report = run_load(args)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print("=" * 60)
+    print("Deep Research Load Test")
+    print("=" * 60)
+    print(f"  offered rate:   {report['offered_rate']}/s for {args.duration}s")
+    print(f"  tasks started:  {report['started']}  {report['statuses']}")
+    print(f"  throughput:     {report['tasks_per_sec']} tasks/s")
+    print(f"  end-to-end:     p50 {report['e2e_p50_s']}s  p99 {report['e2e_p99_s']}s")
+    print(f"  server threads: {report['threads']}  (pid {report['server_pid']})")
+    print(f"  server rss MB:  {report['rss_mb']}")
+    print(f"  tracked tasks:  {report['tracked_background_tasks']}")
+    print(f"  provider 429s:  {report['provider_429s']}")
+    print(f"  cache hits:     {report['research_cache_hits']}")
+    calls = report["llm_calls"]
+    print(f"  llm calls:      {calls['calls']}  hedged {calls['hedged']} ({calls['hedge_rate']:.1%})"
+          f"  hedge wins {calls['hedge_wins']}  failovers {calls['failovers']}")
+    if calls["p99_ms"] is not None:
+        print(f"  llm call p99:   {calls['p99_ms']:.0f}ms")
+    baseline = report.get("baseline")
+    if baseline and baseline["llm_p99_ms"] is not None:
+        print(f"  without hedge:  llm call p99 {baseline['llm_p99_ms']:.0f}ms  end-to-end p99 {baseline['e2e_p99_s']}s"
+              f"  provider 429s {baseline['provider_429s']}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,31 +9,89 @@ This server provides REST endpoints for:
 """
 
 import asyncio
+import threading
+import time
 import uuid
 import sys
 import os
 from contextlib import asynccontextmanager
 
-from flask import Flask, request, jsonify
+from flask import Flask, request
 from flask_cors import CORS
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-
-from config import HOST, PORT, validate_config, LLM_PROVIDER
+# modules shared with recSystem live in the repository root's shared/ package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    HOST, PORT, validate_config, LLM_PROVIDER, LLM_HEDGE_PROVIDER, RESEARCH_CACHE_TTL_HOURS, RESEARCH_RESULTS_PATH,
+)
+from shared.negotiation import CompactResponses, respond
+from shared.profiling import PROFILE_REQUESTS, RequestProfiler, phase
+from shared.querylog import WARMUP_QUERIES, QueryLog
 from models.schemas import TaskStatus, FragranceRecommendation
 from tasks.background import TaskManager
-from agents.planner import PlannerAgent
-from agents.searcher import SearcherAgent
-from agents.analyzer import AnalyzerAgent
+from tasks.results import ResearchCache, research_key
 
 app = Flask(__name__)
 CORS(app)
 
+if PROFILE_REQUESTS:
+    RequestProfiler(app)
+
+# gzip/brotli for clients that accept it, registered after the profiler so it is timed
+CompactResponses(app)
+
 
 task_manager = TaskManager()
 
 _background_tasks = {}
 
+# completed research, warmed from the most frequent logged requests at startup
+research_cache = ResearchCache(ttl=RESEARCH_CACHE_TTL_HOURS * 3600)
+# the query log holds only request hashes; what was researched for them is stored once per result
+query_log = QueryLog()
+result_store = QueryLog(RESEARCH_RESULTS_PATH)
+ready = threading.Event()
+
+
+def log_request(key: str):
+    """Log a served research request by its key, a hash of the notes and preferences."""
+    query_log.record({"key": key})
+
+
+def store_result(key: str, recommendations: list, researched_at: float):
+    """Keep freshly researched recommendations for warm-up; cache hits are not stored again."""
+    result_store.record({
+        "key": key,
+        "researched_at": researched_at,
+        "recommendations": [r.model_dump() for r in recommendations],
+    })
+
+
+def warm_research_cache():
+    """Load results for the most frequent logged requests into the cache, then report ready."""
+    try:
+        warmed = 0
+        stored = {entry["key"]: entry for entry in result_store.most_common(None, key="key")}
+        for logged in query_log.most_common(WARMUP_QUERIES, key="key"):
+            entry = stored.get(logged["key"])
+            if entry is None:
+                continue
+            recommendations = [FragranceRecommendation(**r) for r in entry["recommendations"]]
+            warmed += research_cache.put(entry["key"], recommendations, entry["researched_at"])
+        print(f"Warmed {warmed} cached research results from the query log")
+    except Exception as e:
+        print(f"Cache warm-up failed: {e}")
+    finally:
+        ready.set()
+
+
+if query_log.path:
+    threading.Thread(target=warm_research_cache, daemon=True).start()
+else:
+    ready.set()
+
 
 def run_async(coro):
     """Run an async coroutine from sync context.
@@ -55,6 +113,11 @@ def run_async(coro):
 
 async def run_research_pipeline(task_id: str, notes: list, preferences: str):
     """Execute the full research pipeline as a background task."""
+    # agents pull in pydantic_ai and the provider SDKs, so they load on the first task
+    from agents.planner import PlannerAgent
+    from agents.searcher import SearcherAgent
+    from agents.analyzer import AnalyzerAgent
+
     try:
         # Phase 1: Planning (10%)
         await task_manager.update_task(
@@ -91,6 +154,14 @@ async def run_research_pipeline(task_id: str, notes: list, preferences: str):
         # Complete
         await task_manager.complete_task(task_id, recommendations)
 
+        # without search results these are fallback picks, not worth reusing
+        if search_results:
+            key = research_key(notes, preferences)
+            researched_at = time.time()
+            research_cache.put(key, recommendations, researched_at)
+            store_result(key, recommendations, researched_at)
+            log_request(key)
+
     except Exception as e:
         print(f"Research pipeline error for task {task_id}: {e}")
         await task_manager.fail_task(task_id, str(e))
@@ -102,7 +173,6 @@ def start_background_task(task_id: str, notes: list, preferences: str):
     Creates a dedicated event loop for the entire pipeline to ensure
     pydantic_ai's async clients have a stable loop throughout execution.
     """
-    import threading
 
     def run_in_thread():
         # create new event loop for thread
@@ -143,44 +213,63 @@ def start_background_task(task_id: str, notes: list, preferences: str):
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint."""
-    return jsonify({"status": "ok", "service": "deep-research"})
+    """Health check endpoint, ready once the research cache has been warmed."""
+    if not ready.is_set():
+        return respond({"status": "warming", "service": "deep-research"}), 503
+    return respond({"status": "ok", "service": "deep-research", "cached_research": len(research_cache)})
 
 
 @app.route('/api/research/start', methods=['POST'])
 def start_research():
     """Start a new deep research task."""
     try:
-        data = request.get_json()
-        notes = data.get('notes', [])
-        preferences = data.get('preferences', '')
+        with phase('parse'):
+            data = request.get_json()
+            notes = data.get('notes', [])
+            preferences = data.get('preferences', '')
 
-        if not notes or not isinstance(notes, list):
-            return jsonify({"error": "notes array is required"}), 400
+            if not notes or not isinstance(notes, list):
+                return respond({"error": "notes array is required"}), 400
 
         task_id = str(uuid.uuid4())
-        run_async(task_manager.create_task(task_id, notes, preferences))
-
-        start_background_task(task_id, notes, preferences)
-
-        return jsonify({
+        with phase('create'):
+            run_async(task_manager.create_task(task_id, notes, preferences))
+
+        # identical research done recently: complete the task straight away
+        key = research_key(notes, preferences)
+        cached = research_cache.get(key)
+        if cached is not None:
+            recommendations, researched_at = cached
+            run_async(task_manager.complete_task(task_id, recommendations))
+            log_request(key)
+            return respond({
+                "task_id": task_id,
+                "status": "completed",
+                "message": "Research served from cache"
+            })
+
+        with phase('dispatch'):
+            start_background_task(task_id, notes, preferences)
+
+        return respond({
             "task_id": task_id,
             "status": "pending",
             "message": "Research task started"
         })
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return respond({"error": str(e)}), 500
 
 
 @app.route('/api/research/status/<task_id>', methods=['GET'])
 def get_status(task_id):
     """Get status of a research task."""
     try:
-        result = run_async(task_manager.get_task(task_id))
+        with phase('lookup'):
+            result = run_async(task_manager.get_task(task_id))
 
         if not result:
-            return jsonify({"error": "Task not found"}), 404
+            return respond({"error": "Task not found"}), 404
 
         response = {
             "task_id": result.task_id,
@@ -201,10 +290,10 @@ def get_status(task_id):
                 for r in result.recommendations
             ]
 
-        return jsonify(response)
+        return respond(response)
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return respond({"error": str(e)}), 500
 
 
 @app.route('/api/research/cancel/<task_id>', methods=['POST'])
@@ -214,12 +303,27 @@ def cancel_research(task_id):
         cancelled = run_async(task_manager.cancel_task(task_id))
 
         if cancelled:
-            return jsonify({"message": "Task cancelled"})
+            return respond({"message": "Task cancelled"})
         else:
-            return jsonify({"error": "Task not found or already completed"}), 400
+            return respond({"error": "Task not found or already completed"}), 400
+
+    except Exception as e:
+        return respond({"error": str(e)}), 500
+
+
+@app.route('/api/research/metrics', methods=['GET'])
+def research_metrics():
+    """Hedge rate and tail latency of LLM calls since startup."""
+    try:
+        llm_calls = None
+        # no LLM calls before the first research task, and importing them here would load pydantic_ai
+        if 'agents.hedging' in sys.modules:
+            llm_calls = sys.modules['agents.hedging'].metrics.snapshot()
+
+        return respond({"hedge_provider": LLM_HEDGE_PROVIDER or None, "llm_calls": llm_calls})
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return respond({"error": str(e)}), 500
 
 
 if __name__ == '__main__':
@@ -243,6 +347,7 @@ if __name__ == '__main__':
     print(f"  POST /api/research/start - Start research")
     print(f"  GET  /api/research/status/<task_id> - Get status")
     print(f"  POST /api/research/cancel/<task_id> - Cancel task")
+    print(f"  GET  /api/research/metrics - LLM call hedging metrics")
     print("=" * 60)
 
     app.run(host=HOST, port=PORT, debug=True)
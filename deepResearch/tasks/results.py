@@ -0,0 +1,65 @@
+"""Cache of completed research, keyed by the normalized request."""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from models.schemas import FragranceRecommendation
+
+DEFAULT_CACHE_SIZE = 1000
+
+
+def normalize_notes(notes: List[str]) -> List[str]:
+    """Lowercased, deduplicated and sorted fragrance notes."""
+    return sorted({" ".join(str(note).lower().split()) for note in notes} - {""})
+
+
+def research_key(notes: List[str], preferences: str) -> str:
+    """Stable key for a research request; free-text preferences only enter hashed."""
+    normalized = {
+        "notes": normalize_notes(notes),
+        "preferences": " ".join(preferences.lower().split()),
+    }
+    return hashlib.blake2b(json.dumps(normalized, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ResearchCache:
+    """Thread-safe LRU cache of recommendations per research key, expiring after ttl seconds."""
+
+    def __init__(self, ttl: float, max_size: int = DEFAULT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[List[FragranceRecommendation], float]]:
+        """Return (recommendations, researched_at) if cached and still fresh."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, recommendations: List[FragranceRecommendation], researched_at: float = None) -> bool:
+        """Cache recommendations; returns False if they have already expired."""
+        researched_at = time.time() if researched_at is None else researched_at
+        if time.time() - researched_at > self.ttl:
+            return False
+        with self._lock:
+            self._entries[key] = (recommendations, researched_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return True
+
+    def __len__(self):
+        return len(self._entries)
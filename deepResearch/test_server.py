@@ -0,0 +1,506 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config
+from agents import hedging, ratelimit, searcher
+from agents.ratelimit import ProviderLimiter
+from models.schemas import TaskStatus
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# cold import budget for server.py, raise it on slow CI machines
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "400"))
+
+# python-dotenv is not listed: config.py imports it whenever a .env exists, as after setup
+HEAVY_MODULES = ("pydantic_ai", "duckduckgo_search", "groq", "google.genai")
+
+
+def import_times(module):
+    """import a module in a fresh interpreter and return {name: cumulative_ms}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SERVICE_DIR, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+class TestColdStart:
+    """tests for the import-time budget of the server."""
+
+    def test_heavy_modules_not_imported(self):
+        """test that importing the server skips pydantic_ai, provider SDKs and search."""
+        loaded = import_times("server")
+
+        for heavy in HEAVY_MODULES:
+            assert not any(name == heavy or name.startswith(heavy + ".") for name in loaded), heavy
+
+    def test_import_within_budget(self):
+        """test that importing the server stays under the import-time budget."""
+        # best of three to smooth out a cold disk cache
+        best = min(import_times("server")["server"] for _ in range(3))
+
+        assert best < IMPORT_BUDGET_MS
+
+    def test_health_without_agents(self):
+        """test that /health answers without loading the agents."""
+        code = (
+            "import sys, server\n"
+            "response = server.app.test_client().get('/health')\n"
+            "assert response.status_code == 200\n"
+            "assert 'pydantic_ai' not in sys.modules\n"
+        )
+        subprocess.run([sys.executable, "-c", code], cwd=SERVICE_DIR, check=True)
+
+
+class TestDeferredAgents:
+    """tests that the pipeline still loads its agents on first use."""
+
+    @pytest.fixture
+    def stubs(self):
+        """route agents to pydantic_ai's TestModel and searches to a fake DDGS."""
+        from pydantic_ai.models.test import TestModel
+
+        class FakeDDGS:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def text(self, query, max_results=8):
+                return [{"title": query, "body": "vanilla, musk", "href": "https://example.com"}]
+
+        saved = (searcher.DDGS, searcher.HAS_DDGS)
+        config.set_model_override(TestModel())
+        searcher.DDGS, searcher.HAS_DDGS = FakeDDGS, True
+        yield
+        config.set_model_override(None)
+        searcher.DDGS, searcher.HAS_DDGS = saved
+
+    def test_pipeline_completes(self, stubs):
+        """test that a research task completes with stubbed backends."""
+        import server
+
+        asyncio.run(server.task_manager.create_task("t1", ["vanilla"], ""))
+        asyncio.run(server.run_research_pipeline("t1", ["vanilla"], ""))
+        result = asyncio.run(server.task_manager.get_task("t1"))
+
+        assert result.status == TaskStatus.COMPLETED
+        assert result.recommendations
+
+    def test_agents_package_is_lazy(self):
+        """test that agent classes resolve through the package on access."""
+        import agents
+
+        assert agents.SearcherAgent.__name__ == "SearcherAgent"
+        with pytest.raises(AttributeError):
+            agents.NotAnAgent
+
+
+class TestLoadHarness:
+    """tests for the load test stubs and its out-of-process server."""
+
+    @pytest.fixture
+    def harness(self, monkeypatch):
+        """the loadtest module with its stub provider and search installed in this process."""
+        import random
+        import loadtest
+
+        args = loadtest.build_parser().parse_args(
+            ["--llm-latency-ms", "1", "--llm-sigma", "0", "--search-latency-ms", "1", "--search-sigma", "0"]
+        )
+        monkeypatch.setitem(ratelimit._limiters, config.LLM_PROVIDER, ProviderLimiter(1e6, 1e9))
+        restore = loadtest.install_stubs(args, random.Random(0))
+        yield loadtest
+        restore()
+
+    def test_stubs_match_agent_shapes(self, harness):
+        """test that every agent parses the stub model's output and the stub search results."""
+        from agents import AnalyzerAgent, PlannerAgent, SearcherAgent
+
+        async def pipeline():
+            plan = await PlannerAgent().create_plan(["vanilla"])
+            results = await SearcherAgent().execute_searches(plan.search_tasks)
+            return plan, results, await AnalyzerAgent().synthesize(["vanilla"], "", results)
+
+        plan, results, recommendations = asyncio.run(pipeline())
+
+        assert [task.query for task in plan.search_tasks] == [f"stub perfume search {i}" for i in range(3)]
+        assert len(results) == 3 and all("Stub Perfume" in r.summary for r in results)
+        assert [r.Name for r in recommendations] == [f"Stub Perfume {i}" for i in range(3)]
+
+    def test_stub_search_results(self, harness):
+        """test that the stub DDGS returns DuckDuckGo-shaped results."""
+        results = searcher.SearcherAgent()._sync_search("rose", 4)
+
+        assert len(results) == 4
+        assert all(set(r) == {"title", "body", "href"} and r["href"] for r in results)
+
+    def test_server_runs_in_child_process(self):
+        """test that the load test samples a separate server process, not its own clients."""
+        import loadtest
+
+        args = loadtest.build_parser().parse_args([
+            "--rate", "4", "--duration", "1", "--poll-interval", "0.05", "--max-clients", "8",
+            "--llm-latency-ms", "5", "--search-latency-ms", "5",
+        ])
+        report = loadtest.run_load(args)
+
+        assert report["server_pid"] != os.getpid()
+        assert report["statuses"] == {"completed": report["started"]}
+        assert report["llm_calls"]["calls"] >= 5 * report["started"]
+        if os.path.exists("/proc/self/status"):
+            assert report["threads"]["peak"] >= 1 and report["rss_mb"]["peak"] > 0
+
+
+class TestRateLimiter:
+    """tests for the shared provider limiter and 429 retries."""
+
+    def test_requests_per_minute_enforced(self):
+        """test that calls beyond the burst wait for the bucket to refill."""
+        limiter = ProviderLimiter(requests_per_minute=600, tokens_per_minute=1e9)
+        limiter.requests.tokens = 0
+
+        async def acquire_three():
+            start = time.monotonic()
+            for _ in range(3):
+                await limiter.acquire(1)
+            return time.monotonic() - start
+
+        # 600/min refills one request every 100ms
+        assert 0.25 < asyncio.run(acquire_three()) < 1.0
+
+    def test_fifo_across_threads(self):
+        """test that callers on different threads and loops are served in arrival order."""
+        limiter = ProviderLimiter(requests_per_minute=1200, tokens_per_minute=1e9)
+        limiter.requests.tokens = 0
+        served = []
+
+        def worker(i):
+            async def go():
+                await limiter.acquire(1)
+                served.append(i)
+            asyncio.run(go())
+
+        threads = []
+        for i in range(5):
+            thread = threading.Thread(target=worker, args=(i,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join(timeout=5)
+
+        assert served == [0, 1, 2, 3, 4]
+
+    def test_cancelled_waiter_gives_up_its_turn(self):
+        """test that a cancelled waiter does not block the queue."""
+        limiter = ProviderLimiter(requests_per_minute=600, tokens_per_minute=1e9)
+        limiter.requests.tokens = 0
+
+        async def scenario():
+            first = asyncio.create_task(limiter.acquire(1))
+            second = asyncio.create_task(limiter.acquire(1))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            await asyncio.wait_for(second, timeout=1)
+            return first.cancelled()
+
+        assert asyncio.run(scenario())
+        assert not limiter._queue
+
+    def test_429_retried_with_backoff(self, monkeypatch):
+        """test that a 429 is retried, slows the limiter and then succeeds."""
+        from pydantic_ai import Agent
+        from pydantic_ai.exceptions import ModelHTTPError
+        from pydantic_ai.messages import ModelResponse, TextPart
+        from pydantic_ai.models.function import FunctionModel
+
+        calls = []
+
+        def respond(messages, info):
+            calls.append(1)
+            if len(calls) < 3:
+                raise ModelHTTPError(429, "stub", {"error": "slow down"})
+            return ModelResponse(parts=[TextPart("ok")])
+
+        monkeypatch.setattr(ratelimit, "BACKOFF_BASE", 0.01)
+        limiter = ProviderLimiter(requests_per_minute=6000, tokens_per_minute=1e9)
+        monkeypatch.setitem(ratelimit._limiters, "stub", limiter)
+
+        agent = Agent(FunctionModel(respond), output_type=str)
+        result = asyncio.run(ratelimit.run_agent(agent, "hello", provider="stub"))
+
+        assert result.output == "ok"
+        assert len(calls) == 3
+        assert limiter.rate_limited == 2
+        assert limiter.scale < 1.0
+
+    def test_other_errors_not_retried(self):
+        """test that non-429 provider errors are raised immediately."""
+        from pydantic_ai import Agent
+        from pydantic_ai.exceptions import ModelHTTPError
+        from pydantic_ai.models.function import FunctionModel
+
+        def respond(messages, info):
+            raise ModelHTTPError(500, "stub", {"error": "boom"})
+
+        agent = Agent(FunctionModel(respond), output_type=str)
+        with pytest.raises(ModelHTTPError):
+            asyncio.run(ratelimit.run_agent(agent, "hello", provider="stub-500"))
+        assert ratelimit.get_limiter("stub-500").rate_limited == 0
+
+
+class TestHedging:
+    """tests for hedged LLM calls and provider failover."""
+
+    @pytest.fixture
+    def providers(self, monkeypatch):
+        """stub primary and hedge providers; returns a function to set their behaviour."""
+        from pydantic_ai.exceptions import ModelHTTPError
+        from pydantic_ai.messages import ModelResponse, TextPart
+        from pydantic_ai.models.function import FunctionModel
+
+        behaviour = {}
+
+        def stub(provider):
+            async def respond(messages, info):
+                delay, error = behaviour[provider]
+                await asyncio.sleep(delay)
+                if error:
+                    raise ModelHTTPError(error, provider, {"error": "stub"})
+                return ModelResponse(parts=[TextPart(provider)])
+            return FunctionModel(respond)
+
+        monkeypatch.setattr(config, "LLM_HEDGE_PROVIDER", "stub-hedge")
+        monkeypatch.setattr(config, "LLM_HEDGE_DELAY_MS", 50)
+        for provider in (config.LLM_PROVIDER, "stub-hedge"):
+            config.set_model_override(stub(provider), provider)
+            monkeypatch.setitem(ratelimit._limiters, provider, ProviderLimiter(1e6, 1e9))
+        hedging.metrics.reset()
+
+        def configure(primary, hedge):
+            behaviour[config.LLM_PROVIDER], behaviour["stub-hedge"] = primary, hedge
+
+        yield configure
+        for provider in (config.LLM_PROVIDER, "stub-hedge"):
+            config.set_model_override(None, provider)
+        hedging.metrics.reset()
+
+    def test_fast_primary_not_hedged(self, providers):
+        """test that a call answered within the hedge delay never reaches the hedge provider."""
+        providers(primary=(0.0, None), hedge=(0.0, None))
+        agent = hedging.HedgedAgent("test", output_type=str)
+
+        result = asyncio.run(agent.run("hello"))
+
+        assert result.output == config.LLM_PROVIDER
+        assert hedging.metrics.snapshot()["hedged"] == 0
+
+    def test_slow_primary_hedged(self, providers):
+        """test that a slow primary is hedged and the faster answer wins."""
+        providers(primary=(2.0, None), hedge=(0.0, None))
+        agent = hedging.HedgedAgent("test", output_type=str)
+
+        start = time.monotonic()
+        result = asyncio.run(agent.run("hello"))
+
+        assert result.output == "stub-hedge"
+        assert time.monotonic() - start < 1.0
+        snapshot = hedging.metrics.snapshot()
+        assert snapshot["hedged"] == 1
+        assert snapshot["hedge_wins"] == 1
+
+    def test_cancelled_primary_censored(self, providers):
+        """test that a primary cancelled by a winning hedge is not a latency sample."""
+        providers(primary=(2.0, None), hedge=(0.0, None))
+        agent = hedging.HedgedAgent("test", output_type=str)
+
+        asyncio.run(agent.run("hello"))
+
+        snapshot = hedging.metrics.snapshot()
+        assert snapshot["primary_censored"] == 1
+        assert snapshot["p99_primary_ms"] is None
+        assert hedging.metrics.hedge_delay("test") == config.LLM_HEDGE_DELAY_MS / 1000
+
+    def test_primary_win_after_hedge_is_sampled(self, providers):
+        """test that a hedged call the primary still wins records the primary's real latency."""
+        providers(primary=(0.1, None), hedge=(2.0, None))
+        agent = hedging.HedgedAgent("test", output_type=str)
+
+        result = asyncio.run(agent.run("hello"))
+
+        snapshot = hedging.metrics.snapshot()
+        assert result.output == config.LLM_PROVIDER
+        assert snapshot["hedged"] == 1 and snapshot["primary_censored"] == 0
+        assert snapshot["p99_primary_ms"] >= 100
+
+    def test_failover_on_error(self, providers):
+        """test that a failed primary call fails over to the hedge provider."""
+        providers(primary=(0.0, 500), hedge=(0.0, None))
+        agent = hedging.HedgedAgent("test", output_type=str)
+
+        result = asyncio.run(agent.run("hello"))
+
+        assert result.output == "stub-hedge"
+        assert hedging.metrics.snapshot()["failovers"] == 1
+
+    def test_both_fail_raises(self, providers):
+        """test that the primary's error is raised when both providers fail."""
+        from pydantic_ai.exceptions import ModelHTTPError
+
+        providers(primary=(0.0, 500), hedge=(0.0, 503))
+        agent = hedging.HedgedAgent("test", output_type=str)
+
+        with pytest.raises(ModelHTTPError) as error:
+            asyncio.run(agent.run("hello"))
+        assert error.value.status_code == 500
+
+    def test_hedge_delay_tracks_percentile(self, monkeypatch):
+        """test that the hedge delay follows the configured percentile once warmed up."""
+        monkeypatch.setattr(config, "LLM_HEDGE_PERCENTILE", 90)
+        metrics = hedging.HedgeMetrics()
+
+        assert metrics.hedge_delay("plan") == config.LLM_HEDGE_DELAY_MS / 1000
+        for i in range(1, 101):
+            metrics.record("plan", i / 100, i / 100, hedged=False, hedge_won=False, failover=False)
+
+        assert metrics.hedge_delay("plan") == pytest.approx(0.9)
+        assert metrics.hedge_delay("analyze") == config.LLM_HEDGE_DELAY_MS / 1000
+
+    def test_metrics_endpoint(self):
+        """test that the metrics endpoint reports the hedge provider and call stats."""
+        import server
+
+        response = server.app.test_client().get("/api/research/metrics")
+
+        assert response.status_code == 200
+        assert "llm_calls" in response.get_json()
+
+
+class TestCompactResponses:
+    """tests for negotiated response formats."""
+
+    def test_msgpack_when_accepted(self):
+        """test that MessagePack is returned for clients that ask for it."""
+        msgpack = pytest.importorskip("msgpack")
+        import server
+
+        response = server.app.test_client().get("/health", headers={"Accept": "application/msgpack"})
+
+        assert response.content_type == "application/msgpack"
+        assert msgpack.unpackb(response.data)["status"] == "ok"
+
+    def test_json_by_default(self):
+        """test that clients without an Accept header still get JSON."""
+        import server
+
+        response = server.app.test_client().get("/api/research/status/missing")
+
+        assert response.status_code == 404
+        assert response.get_json() == {"error": "Task not found"}
+
+
+class TestResearchCache:
+    """tests for the research cache, query log and startup warm-up."""
+
+    def test_key_ignores_note_order_and_case(self):
+        """test that equivalent requests share a cache key."""
+        from tasks.results import research_key
+
+        assert research_key(["Vanilla", "musk "], "Warm") == research_key(["musk", "vanilla"], "warm")
+        assert research_key(["vanilla"], "warm") != research_key(["vanilla"], "fresh")
+
+    def test_expired_results_not_served(self):
+        """test that results older than the ttl are dropped."""
+        from tasks.results import ResearchCache
+
+        cache = ResearchCache(ttl=60)
+
+        assert not cache.put("old", [], researched_at=time.time() - 120)
+        assert cache.put("new", [])
+        assert cache.get("old") is None
+        assert cache.get("new") is not None
+
+    def test_cached_request_completes_immediately(self, monkeypatch):
+        """test that a cached request completes without starting a pipeline."""
+        import server
+        from models.schemas import FragranceRecommendation
+        from tasks.results import research_key
+
+        rec = FragranceRecommendation(Name="Oud Wood", Brand="Tom Ford", Notes="oud", reasoning="cached")
+        server.research_cache.put(research_key(["oud"], "cached test"), [rec])
+        monkeypatch.setattr(server, "start_background_task", lambda *args: pytest.fail("pipeline started"))
+        client = server.app.test_client()
+
+        started = client.post("/api/research/start", json={"notes": ["OUD"], "preferences": "cached test"})
+        status = client.get(f"/api/research/status/{started.get_json()['task_id']}").get_json()
+
+        assert started.get_json()["status"] == "completed"
+        assert status["recommendations"][0]["Name"] == "Oud Wood"
+
+    @pytest.fixture
+    def logs(self, tmp_path, monkeypatch):
+        """a fresh query log and result store for the server; returns their paths."""
+        import server
+        from shared.querylog import QueryLog
+        from tasks.results import ResearchCache
+
+        paths = tmp_path / "queries.jsonl", tmp_path / "queries.results.jsonl"
+        monkeypatch.setattr(server, "query_log", QueryLog(str(paths[0])))
+        monkeypatch.setattr(server, "result_store", QueryLog(str(paths[1])))
+        monkeypatch.setattr(server, "research_cache", ResearchCache(ttl=3600))
+        yield paths
+        server.query_log.close()
+        server.result_store.close()
+
+    def test_warm_up_replays_logged_results(self, logs, monkeypatch):
+        """test that warm-up loads the results of the most frequent logged requests into the cache."""
+        import server
+        from models.schemas import FragranceRecommendation
+        from tasks.results import research_key
+
+        monkeypatch.setattr(server, "ready", threading.Event())
+        rec = FragranceRecommendation(Name="Santal 33", Brand="Le Labo", Notes="sandalwood", reasoning="logged")
+        server.store_result(research_key(["sandalwood"], ""), [rec], time.time())
+        server.log_request(research_key(["sandalwood"], ""))
+        server.query_log.close()
+        server.result_store.close()
+
+        assert server.app.test_client().get("/health").status_code == 503
+        server.warm_research_cache()
+
+        assert server.research_cache.get(research_key(["sandalwood"], ""))[0] == [rec]
+        assert server.app.test_client().get("/health").status_code == 200
+
+    def test_log_keeps_no_user_text_or_payloads(self, logs, monkeypatch):
+        """test that the query log holds only request hashes and hits store nothing new."""
+        import server
+        from models.schemas import FragranceRecommendation
+        from tasks.results import research_key
+
+        rec = FragranceRecommendation(Name="Oud Wood", Brand="Tom Ford", Notes="oud", reasoning="cached")
+        server.research_cache.put(research_key(["my secret note"], "private"), [rec])
+        client = server.app.test_client()
+        for _ in range(2):
+            client.post("/api/research/start", json={"notes": ["My Secret Note"], "preferences": "private"})
+        server.query_log.close()
+
+        lines = logs[0].read_text().splitlines()
+        assert lines == [json.dumps({"key": research_key(["my secret note"], "private")}, separators=(",", ":"))] * 2
+        assert not logs[1].exists()
@@ -1,45 +1,283 @@
-from flask import Flask, request, jsonify
+import os
+import sys
+import threading
+
+from flask import Flask, g, request
 from flask_cors import CORS
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
+
+# modules shared with deepResearch live in the repository root's shared/ package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.negotiation import CompactResponses, respond
+from shared.profiling import PROFILE_REQUESTS, RequestProfiler, phase
+from shared.querylog import WARMUP_QUERIES, QueryLog
+
+from catalog import matrix_memory_usage
+from fields import FIELDS
+from profiles import build_profile, favorites_fingerprint, resolve_favorites
+from results import loggable_filters, normalize_filters, normalize_query, result_key
+from snapshot import FILTER_PARAMS, IndexManager
 
 app = Flask(__name__)
 CORS(app) 
 
-df = pd.read_csv('perfumeData.csv', encoding='ISO-8859-1')
-df.drop_duplicates(inplace=True)
-df.dropna(inplace=True)
+if PROFILE_REQUESTS:
+    RequestProfiler(app)
+
+# gzip/brotli for clients that accept it, registered after the profiler so it is timed
+CompactResponses(app)
+
+CATALOG_CSV = 'perfumeData.csv'
+
+# prebuilt index from ingest.py, for catalogs too large to fit in memory
+CATALOG_INDEX_DIR = os.getenv('CATALOG_INDEX_DIR', '')
+
+# seconds between checks for a changed catalog, 0 only reloads on POST /reload
+INDEX_WATCH_INTERVAL = float(os.getenv('INDEX_WATCH_INTERVAL', '0'))
+
+# most frequent logged queries, replayed into each snapshot's result cache
+query_log = QueryLog()
+ready = threading.Event()
+
+
+def warm_snapshot(snapshot):
+    """Replay the most frequent logged queries into a snapshot's result cache."""
+    warmed = snapshot.warm(query_log.most_common(WARMUP_QUERIES))
+    print(f"Warmed {warmed} cached recommendations from the query log")
+
+
+# the catalog and everything built from it, swapped whole on reload
+index = IndexManager(CATALOG_CSV, CATALOG_INDEX_DIR, prepare=warm_snapshot)
+
+
+def warm_result_cache():
+    """Warm the first snapshot, then report ready."""
+    try:
+        warm_snapshot(index.current)
+    except Exception as e:
+        print(f"Cache warm-up failed: {e}")
+    finally:
+        ready.set()
+
+
+if query_log.path:
+    threading.Thread(target=warm_result_cache, daemon=True).start()
+else:
+    ready.set()
+
+if INDEX_WATCH_INTERVAL > 0:
+    index.watch(INDEX_WATCH_INTERVAL)
+
+
+def snapshot():
+    """The snapshot this request reads from, pinned on first use so a reload never mixes versions."""
+    if 'snapshot' not in g:
+        g.snapshot = index.current
+    return g.snapshot
+
+
+@app.after_request
+def index_version_header(response):
+    # row ids in responses are only meaningful against this version
+    if 'snapshot' in g:
+        response.headers['X-Index-Version'] = str(g.snapshot.version)
+    return response
+
+
+def filter_args():
+    """The request's normalized filters by parameter, each may be repeated (?brand=A&brand=B)."""
+    return normalize_filters({param: request.args.getlist(param) for param in FILTER_PARAMS})
+
+
+def weight_args(vectorizer):
+    """Per-request field weight overrides (?name_weight=0&notes_weight=2), by field.
+
+    Raises ValueError for a weight the vectorizer would not accept.
+    """
+    weights = {}
+    for field in FIELDS:
+        param = f'{field.lower()}_weight'
+        value = request.args.get(param)
+        if value is not None:
+            try:
+                weights[field] = float(value)
+            except ValueError:
+                raise ValueError(f"'{param}' must be a number") from None
+    vectorizer.resolve_weights(weights)
+    return weights
+
 
-# extract needed features
-features = df['Name'] + ' ' + df['Brand'] + ' ' + df['Notes']
-vectorizer = TfidfVectorizer()
-feature_vectors = vectorizer.fit_transform(features.values.astype('U'))
+@app.route('/health', methods=['GET'])
+def health():
+    """Ready once the result cache has been warmed."""
+    if not ready.is_set():
+        return respond({"status": "warming", "service": "recommendations"}), 503
+    return respond({
+        "status": "ok",
+        "service": "recommendations",
+        "index_version": index.current.version,
+        "cached_results": len(index.current.results),
+    })
+
+
+@app.route('/reload', methods=['POST'])
+def reload_index():
+    """Rebuild the index from the catalog in the background and swap it in when ready."""
+    started = index.reload_in_background()
+    return respond({
+        "message": "Reload started" if started else "Reload already running",
+        "index_version": index.current.version,
+    }), 202
 
 
 @app.route('/recommend', methods=['GET'])
 def recommend():
     try:
-        input_notes = request.args.get('notes', '')
+        with phase('parse'):
+            input_notes = request.args.get('notes', '')
 
-        if not input_notes:
-            return jsonify({"error": "Missing 'notes' parameter"}), 400
+            if not input_notes:
+                return respond({"error": "Missing 'notes' parameter"}), 400
 
-        input_vector = vectorizer.transform([input_notes])
+            n = int(request.args.get('n', 5))  # default is 5 recommendations
 
-        # similarity scores between the input and all perfumes
-        similarity_scores = cosine_similarity(input_vector, feature_vectors)
+            index_snapshot = snapshot()
+            filters = filter_args()
+            try:
+                weights = weight_args(index_snapshot.vectorizer)
+            except ValueError as e:
+                return respond({"error": str(e)}), 400
+            query = normalize_query(index_snapshot.vectorizer, input_notes)
+            key = result_key(query, n, filters, weights)
 
-        n = int(request.args.get('n', 5))  # default is 5 recommendations
-        similar_indices = similarity_scores[0].argsort()[-n:][::-1]
+        cached = index_snapshot.results.get(key)
+        if cached is None:
+            with phase('vectorize'):
+                input_vector = index_snapshot.vectorizer.transform([query], weights)
+
+            # top-n weighted sum of per-field cosine similarities, in one pass over the stacked matrix
+            with phase('score'):
+                similar_indices, scores = index_snapshot.scorer.top_k(
+                    input_vector, n, mask=index_snapshot.filter_mask(filters)
+                )
+            index_snapshot.results.put(key, similar_indices, scores)
+        else:
+            similar_indices, scores = cached
+
+        # only in-vocabulary terms and catalog brands and notes are logged, see results.py
+        if query:
+            entry = {'q': query, 'n': n, 'filters': loggable_filters(index_snapshot.facets, filters)}
+            if weights:
+                entry['weights'] = weights
+            query_log.record(entry)
+
+        # compact mode for callers that hold the catalog: row ids and scores only
+        if request.args.get('format') == 'ids':
+            with phase('serialize'):
+                return respond({
+                    'ids': similar_indices.tolist(),
+                    'scores': scores.astype(np.float64).round(6).tolist(),
+                })
 
         # get details of similar perfumes
-        recommendations = df.iloc[similar_indices].to_dict(orient='records')
+        with phase('select'):
+            recommendations = index_snapshot.catalog.records(similar_indices)
+
+        with phase('serialize'):
+            return respond(recommendations)
+
+    except Exception as e:
+        return respond({"error": str(e)}), 500
+
+
+@app.route('/recommend/favorites', methods=['GET'])
+def recommend_from_favorites():
+    """Recommend perfumes similar to a user's favorites, excluding the favorites."""
+    try:
+        favorites = request.args.getlist('favorite')
+
+        if not favorites:
+            return respond({"error": "Missing 'favorite' parameter"}), 400
+
+        # requests without a user key are still served, just not cached
+        user = request.args.get('user', '')
+        fingerprint = favorites_fingerprint(favorites)
+        index_snapshot = snapshot()
+        try:
+            weights = weight_args(index_snapshot.vectorizer)
+        except ValueError as e:
+            return respond({"error": str(e)}), 400
+
+        cached = index_snapshot.profiles.get(user, fingerprint) if user else None
+        if cached is None:
+            rows, unresolved = resolve_favorites(index_snapshot.facets, favorites)
+            if not len(rows):
+                return respond({"error": "None of the favorites are in the catalog",
+                                 "unresolved": unresolved}), 404
 
-        return jsonify(recommendations)
+            profile = build_profile(index_snapshot.vectorizer, index_snapshot.feature_vectors, rows)
+            if user:
+                index_snapshot.profiles.put(user, fingerprint, rows, profile)
+        else:
+            rows, profile = cached
+
+        n = int(request.args.get('n', 5))  # default is 5 recommendations
+
+        # profiles are cached unweighted, the request's field weights apply here
+        profile = index_snapshot.vectorizer.weigh(profile, weights)
+        mask = index_snapshot.filter_mask(filter_args(), exclude_rows=rows)
+        similar_indices, _ = index_snapshot.scorer.top_k(profile, n, mask=mask)
+
+        return respond(index_snapshot.catalog.records(similar_indices))
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return respond({"error": str(e)}), 500
+
+
+@app.route('/recommend/favorites/<user>', methods=['DELETE'])
+def invalidate_profile(user):
+    """Drop a user's cached profile, e.g. after their favorites change."""
+    snapshot().profiles.invalidate(user)
+    return respond({"message": "Profile invalidated"})
+
+
+@app.route('/typeahead', methods=['GET'])
+def typeahead():
+    """Complete a search-box prefix against perfume names, brands and notes."""
+    try:
+        prefix = request.args.get('q', '')
+        n = int(request.args.get('n', 8))
+
+        return respond(snapshot().typeahead.complete(prefix, n))
+
+    except Exception as e:
+        return respond({"error": str(e)}), 500
+
+
+@app.route('/memory', methods=['GET'])
+def memory_report():
+    """Break down the bytes held by each in-memory index component."""
+    index_snapshot = snapshot()
+    components = {
+        'catalog': index_snapshot.catalog.memory_usage(),
+        'feature_vectors': matrix_memory_usage(index_snapshot.feature_vectors),
+        'vectorizer': index_snapshot.vectorizer.memory_usage(),
+        'facets': index_snapshot.facets.memory_usage(),
+        'typeahead': index_snapshot.typeahead.memory_usage(),
+        'profile_cache': index_snapshot.profiles.memory_usage(),
+        'result_cache': index_snapshot.results.memory_usage(),
+    }
+    totals = {name: sum(parts.values()) for name, parts in components.items()}
+
+    return respond({
+        'rows': len(index_snapshot.catalog),
+        'components': components,
+        'totals': totals,
+        'total_bytes': sum(totals.values()),
+        # old snapshots linger only while requests that pinned them are in flight
+        'live_snapshots': index.live_snapshots,
+    })
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""Benchmark blocked scoring as the shard count grows.
+
+Tiles the perfume feature matrix up to a synthetic catalog size and times
+top-k queries for 1..N shards.
+
+usage: python bench_scoring.py [--rows 2000000] [--queries 50] [--max-shards 8]
+"""
+
+import argparse
+import os
+import time
+
+import scipy.sparse as sp
+
+from app import index
+from scoring import BlockedScorer
+
+vectorizer, feature_vectors = index.current.vectorizer, index.current.feature_vectors
+
+QUERIES = [
+    'vanilla musk', 'rose jasmine', 'citrus bergamot', 'oud amber',
+    'sandalwood cedar', 'lavender vetiver', 'patchouli incense', 'iris leather',
+]
+
+
+def build_catalog(rows):
+    """Stack copies of the feature matrix until it has at least `rows` rows."""
+    copies = max(1, -(-rows // feature_vectors.shape[0]))
+    return sp.vstack([feature_vectors] * copies, format='csr')[:rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--max-shards', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('-k', type=int, default=5)
+    args = parser.parse_args()
+
+    matrix = build_catalog(args.rows)
+    vectors = [vectorizer.transform([q]) for q in QUERIES]
+    print(f"catalog: {matrix.shape[0]} rows, {matrix.nnz} non-zeros")
+    print(f"{'shards':>6} {'mean ms':>9} {'speedup':>8}")
+
+    baseline = None
+    for shards in range(1, args.max_shards + 1):
+        scorer = BlockedScorer(matrix, shards=shards)
+        scorer.top_k(vectors[0], args.k)  # warm up the pool
+
+        start = time.perf_counter()
+        for i in range(args.queries):
+            scorer.top_k(vectors[i % len(vectors)], args.k)
+        mean_ms = (time.perf_counter() - start) / args.queries * 1000
+
+        scorer.close()
+
+        baseline = baseline or mean_ms
+        print(f"{shards:>6} {mean_ms:>9.2f} {baseline / mean_ms:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Memory-compact perfume catalog.
+
+Replaces the object-dtype DataFrame that used to back /recommend:
+
+- names and the original notes text live in contiguous UTF-8 buffers with
+  int64 offsets, so records return the notes exactly as the source wrote them
+- brands are interned as categorical codes into a brand table
+- notes are also interned into a note table and stored per row as a flat
+  int32 id array with int64 offsets (CSR layout), used by the facet filters
+
+Records are decoded on demand for the few rows a response returns.
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+NOTE_SEPARATOR = ','
+
+
+def _pack_strings(values):
+    """Pack strings into a contiguous UTF-8 buffer and offsets."""
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return buffer, offsets
+
+
+class PackedStrings:
+    """Read-only sequence of strings held in one UTF-8 buffer with offsets.
+
+    Supports len() and indexing, so bisect works on it directly when the
+    strings were packed in sorted order.
+    """
+
+    def __init__(self, values):
+        self.buffer, self.offsets = _pack_strings(values)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    @property
+    def nbytes(self):
+        return int(self.buffer.nbytes + self.offsets.nbytes)
+
+
+def _strings_nbytes(values):
+    """Approximate heap size of a list of Python strings."""
+    return sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values)
+
+
+def object_nbytes(value):
+    """Approximate heap size of nested tuples, lists, dicts, strings, numbers and numpy arrays."""
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) + (0 if value.base is None else int(value.nbytes))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(object_nbytes(k) + object_nbytes(v) for k, v in value.items())
+    elif isinstance(value, (tuple, list, set, frozenset)):
+        size += sum(object_nbytes(v) for v in value)
+    return size
+
+
+def compact_matrix(matrix):
+    """Return the matrix as CSR with float32 data and int32 indices where they fit."""
+    matrix = matrix.tocsr().astype(np.float32, copy=False)
+    if matrix.nnz < np.iinfo(np.int32).max:
+        matrix.indices = matrix.indices.astype(np.int32, copy=False)
+        matrix.indptr = matrix.indptr.astype(np.int32, copy=False)
+    return matrix
+
+
+def matrix_memory_usage(matrix):
+    """Bytes held by each component of a CSR matrix."""
+    return {
+        'data': int(matrix.data.nbytes),
+        'indices': int(matrix.indices.nbytes),
+        'indptr': int(matrix.indptr.nbytes),
+    }
+
+
+def vectorizer_memory_usage(vectorizer):
+    """Approximate bytes held by a fitted TfidfVectorizer."""
+    vocabulary = vectorizer.vocabulary_
+    return {
+        'vocabulary': sys.getsizeof(vocabulary) + _strings_nbytes(list(vocabulary)),
+        'idf': int(vectorizer.idf_.nbytes),
+    }
+
+
+class Catalog:
+    """Column-oriented, interned storage for Name/Brand/Notes rows."""
+
+    columns = ['Name', 'Brand', 'Notes']
+
+    def __init__(self, name_buffer, name_offsets, brand_codes, brands,
+                 note_ids, note_offsets, notes, notes_text_buffer, notes_text_offsets):
+        self.name_buffer = name_buffer
+        self.name_offsets = name_offsets
+        self.notes_text_buffer = notes_text_buffer
+        self.notes_text_offsets = notes_text_offsets
+        self.brand_codes = brand_codes
+        self.brands = brands
+        self.note_ids = note_ids
+        self.note_offsets = note_offsets
+        self.notes = notes
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Build a catalog from a DataFrame with Name, Brand and Notes columns."""
+        name_buffer, name_offsets = _pack_strings(frame['Name'].astype(str).tolist())
+        notes_text_buffer, notes_text_offsets = _pack_strings(frame['Notes'].astype(str).tolist())
+
+        brand_cat = pd.Categorical(frame['Brand'].astype(str))
+        brand_codes = np.asarray(brand_cat.codes)
+        brands = [str(b) for b in brand_cat.categories]
+
+        note_table = {}
+        note_ids = []
+        note_offsets = np.zeros(len(frame) + 1, dtype=np.int64)
+        for row, value in enumerate(frame['Notes'].astype(str)):
+            for note in value.split(NOTE_SEPARATOR):
+                note_ids.append(note_table.setdefault(note.strip(), len(note_table)))
+            note_offsets[row + 1] = len(note_ids)
+
+        return cls(
+            name_buffer, name_offsets, brand_codes, brands,
+            np.asarray(note_ids, dtype=np.int32), note_offsets, list(note_table),
+            notes_text_buffer, notes_text_offsets,
+        )
+
+    def __len__(self):
+        return len(self.name_offsets) - 1
+
+    def name(self, row):
+        """Decode the perfume name of one row."""
+        start, end = self.name_offsets[row], self.name_offsets[row + 1]
+        return self.name_buffer[start:end].tobytes().decode('utf-8')
+
+    def notes_text(self, row):
+        """Decode the notes of one row as the source wrote them."""
+        start, end = self.notes_text_offsets[row], self.notes_text_offsets[row + 1]
+        return self.notes_text_buffer[start:end].tobytes().decode('utf-8')
+
+    def brand(self, row):
+        return self.brands[self.brand_codes[row]]
+
+    def row_note_ids(self, row):
+        """Note ids of one row, in their original order."""
+        return self.note_ids[self.note_offsets[row]:self.note_offsets[row + 1]]
+
+    def record(self, row):
+        """Decode one row into the response format."""
+        return {
+            'Name': self.name(row),
+            'Brand': self.brand(row),
+            'Notes': self.notes_text(row),
+        }
+
+    def records(self, rows):
+        return [self.record(int(row)) for row in rows]
+
+    def memory_usage(self):
+        """Bytes held by each component of the catalog."""
+        return {
+            'name_buffer': int(self.name_buffer.nbytes),
+            'name_offsets': int(self.name_offsets.nbytes),
+            'brand_codes': int(self.brand_codes.nbytes),
+            'brand_table': _strings_nbytes(self.brands),
+            'note_ids': int(self.note_ids.nbytes),
+            'note_offsets': int(self.note_offsets.nbytes),
+            'note_table': _strings_nbytes(self.notes),
+            'notes_text_buffer': int(self.notes_text_buffer.nbytes),
+            'notes_text_offsets': int(self.notes_text_offsets.nbytes),
+        }
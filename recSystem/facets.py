@@ -0,0 +1,125 @@
+"""Precomputed facet postings for filtered recommendations.
+
+Each brand and each note has a sorted posting list of the rows that carry
+it (the transpose of the catalog's brand codes and note ids). A filter is
+turned into a boolean row mask by scattering the postings it names, and the
+scorer applies that mask during top-k selection.
+
+Names are indexed by a sorted array of 64-bit hashes so exact-name lookups
+are a binary search with no per-row Python objects.
+"""
+
+import hashlib
+
+import numpy as np
+import scipy.sparse as sp
+
+from catalog import matrix_memory_usage, object_nbytes
+
+
+def name_key(name):
+    """Normalize a perfume, brand or note name for lookups."""
+    return ' '.join(str(name).split()).lower()
+
+
+def name_hash(name):
+    """Return the 64-bit hash of a normalized name."""
+    digest = hashlib.blake2b(name_key(name).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _postings(row_ids, column_ids, n_rows, n_columns):
+    """CSC incidence matrix: column j's rows are indices[indptr[j]:indptr[j+1]]."""
+    ones = np.ones(len(column_ids), dtype=np.bool_)
+    return sp.csc_matrix(
+        (ones, (row_ids, column_ids)), shape=(n_rows, n_columns), dtype=np.bool_
+    )
+
+
+def _key_table(values):
+    """Map each normalized value to the ids that share it."""
+    table = {}
+    for value_id, value in enumerate(values):
+        table.setdefault(name_key(value), []).append(value_id)
+    return table
+
+
+class FacetIndex:
+    """Brand, note and name postings over a Catalog."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.n_rows = n_rows = len(catalog)
+
+        self.brand_postings = _postings(
+            np.arange(n_rows), catalog.brand_codes, n_rows, len(catalog.brands)
+        )
+        self.brand_keys = _key_table(catalog.brands)
+
+        note_rows = np.repeat(np.arange(n_rows), np.diff(catalog.note_offsets))
+        self.note_postings = _postings(
+            note_rows, catalog.note_ids, n_rows, len(catalog.notes)
+        )
+        self.note_keys = _key_table(catalog.notes)
+
+        hashes = np.array([name_hash(catalog.name(row)) for row in range(n_rows)],
+                          dtype=np.uint64)
+        self.name_order = np.argsort(hashes, kind='stable')
+        self.name_hashes = hashes[self.name_order]
+
+    def memory_usage(self):
+        """Bytes held by the postings, lookup tables and name hashes."""
+        usage = {}
+        for facet in ('brand', 'note'):
+            usage[f'{facet}_postings'] = sum(matrix_memory_usage(getattr(self, f'{facet}_postings')).values())
+            usage[f'{facet}_keys'] = object_nbytes(getattr(self, f'{facet}_keys'))
+        usage['name_order'] = int(self.name_order.nbytes)
+        usage['name_hashes'] = int(self.name_hashes.nbytes)
+        return usage
+
+    def _rows(self, postings, ids):
+        parts = [postings.indices[postings.indptr[i]:postings.indptr[i + 1]] for i in ids]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+
+    def brand_rows(self, brand):
+        """Rows whose brand matches, case-insensitively."""
+        return self._rows(self.brand_postings, self.brand_keys.get(name_key(brand), []))
+
+    def note_rows(self, note):
+        """Rows that list the note, case-insensitively."""
+        return self._rows(self.note_postings, self.note_keys.get(name_key(note), []))
+
+    def name_rows(self, name):
+        """Rows whose perfume name matches, case-insensitively."""
+        target = np.uint64(name_hash(name))
+        lo = np.searchsorted(self.name_hashes, target, side='left')
+        hi = np.searchsorted(self.name_hashes, target, side='right')
+
+        # verify against the stored name to rule out hash collisions
+        key = name_key(name)
+        return np.array([row for row in self.name_order[lo:hi]
+                         if name_key(self.catalog.name(row)) == key], dtype=np.intp)
+
+    def mask(self, brands=(), exclude_brands=(), exclude_notes=(), exclude_names=(),
+             exclude_rows=()):
+        """Build the allowed-row mask for a filter, or None when unfiltered."""
+        if not (brands or exclude_brands or exclude_notes or exclude_names
+                or len(exclude_rows)):
+            return None
+
+        if brands:
+            allowed = np.zeros(self.n_rows, dtype=np.bool_)
+            for brand in brands:
+                allowed[self.brand_rows(brand)] = True
+        else:
+            allowed = np.ones(self.n_rows, dtype=np.bool_)
+
+        for brand in exclude_brands:
+            allowed[self.brand_rows(brand)] = False
+        for note in exclude_notes:
+            allowed[self.note_rows(note)] = False
+        for name in exclude_names:
+            allowed[self.name_rows(name)] = False
+        allowed[np.asarray(exclude_rows, dtype=np.intp)] = False
+
+        return allowed
@@ -0,0 +1,184 @@
+"""Per-field TF-IDF with query-time field weights.
+
+Name, Brand and Notes are vectorized separately, so name and brand terms no
+longer compete with notes inside one document, and fields can be weighted
+per query without refitting. The field matrices are stacked side by side
+into one CSR matrix whose row blocks are each L2-normalized:
+
+    [ name terms | brand terms | notes terms ]
+
+A query is vectorized once into the same stacked space, each field block
+normalized and scaled by its weight, so one sparse product over the stacked
+matrix scores
+
+    score(doc) = sum over fields of weight * cosine(query field, doc field)
+
+at the cost of a single unweighted query.
+"""
+
+import math
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from catalog import vectorizer_memory_usage
+
+FIELDS = ('Name', 'Brand', 'Notes')
+
+
+def parse_weights(spec):
+    """Parse 'Name:0.5,Brand:0.3' into {'Name': 0.5, 'Brand': 0.3}."""
+    weights = {}
+    for part in spec.split(','):
+        if part.strip():
+            field, _, value = part.partition(':')
+            weights[field.strip()] = float(value)
+    return weights
+
+
+# notes carry most of the signal; names and brands break ties and catch direct lookups
+DEFAULT_WEIGHTS = {'Name': 0.5, 'Brand': 0.3, 'Notes': 1.0}
+DEFAULT_WEIGHTS.update(parse_weights(os.getenv('FIELD_WEIGHTS', '')))
+
+
+def field_text(frame, field):
+    """The text of one catalog field, ready to vectorize."""
+    return frame[field].values.astype('U')
+
+
+class FieldVectorizer:
+    """Fitted per-field TfidfVectorizers that vectorize into one stacked space."""
+
+    def __init__(self, vectorizers, weights=None):
+        """vectorizers maps each field to a fitted TfidfVectorizer with default settings."""
+        self.vectorizers = dict(vectorizers)
+        self.fields = tuple(self.vectorizers)
+        self.weights = {field: DEFAULT_WEIGHTS.get(field, 1.0) for field in self.fields}
+        self.weights = self.resolve_weights(weights)
+
+        sizes = [len(v.vocabulary_) for v in self.vectorizers.values()]
+        self.sizes = dict(zip(self.fields, sizes))
+        self.offsets = dict(zip(self.fields, np.cumsum([0] + sizes[:-1]).tolist()))
+        self.n_features = sum(sizes)
+
+        # every field shares the default analyzer, so a query is tokenized once and
+        # each term looked up once: term -> [(field number, stacked column, idf)]
+        self._analyzer = self.vectorizers[self.fields[0]].build_analyzer()
+        self._postings = {}
+        for number, (field, vectorizer) in enumerate(self.vectorizers.items()):
+            offset = self.offsets[field]
+            for term, column in vectorizer.vocabulary_.items():
+                self._postings.setdefault(term, []).append(
+                    (number, offset + column, float(vectorizer.idf_[column]))
+                )
+
+    @classmethod
+    def fit(cls, frame, fields=FIELDS, weights=None):
+        """Fit one vectorizer per field. Returns (vectorizer, stacked document matrix)."""
+        vectorizers = {}
+        blocks = []
+        for field in fields:
+            vectorizers[field] = TfidfVectorizer(dtype=np.float32)
+            blocks.append(vectorizers[field].fit_transform(field_text(frame, field)))
+        return cls(vectorizers, weights), sp.hstack(blocks, format='csr', dtype=np.float32)
+
+    def transform_documents(self, frame):
+        """Stacked, per-field normalized rows for catalog rows."""
+        blocks = [v.transform(field_text(frame, field)) for field, v in self.vectorizers.items()]
+        return sp.hstack(blocks, format='csr', dtype=np.float32)
+
+    def resolve_weights(self, overrides=None):
+        """This vectorizer's field weights with per-query overrides applied."""
+        weights = dict(self.weights)
+        if overrides:
+            unknown = set(overrides) - set(self.fields)
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+            weights.update(overrides)
+        if not all(math.isfinite(w) and w >= 0 for w in weights.values()):
+            raise ValueError("Field weights must be finite and not negative")
+        return weights
+
+    def column_weights(self, weights=None):
+        """Each stacked column's field weight, to reweigh a stored vector."""
+        weights = self.resolve_weights(weights)
+        return np.repeat(
+            np.array([weights[f] for f in self.fields], dtype=np.float32),
+            [self.sizes[f] for f in self.fields],
+        )
+
+    def weigh(self, vectors, weights=None):
+        """Scale the field blocks of stacked vectors (e.g. a taste profile) by field weights."""
+        return sp.csr_matrix(vectors.multiply(self.column_weights(weights)[None, :]), dtype=np.float32)
+
+    def transform(self, texts, weights=None):
+        """Vectorize queries into the stacked space, each field block normalized and weighted."""
+        weights = self.resolve_weights(weights)
+        scale = np.array([weights[f] for f in self.fields], dtype=np.float64)
+
+        indptr = [0]
+        indices = []
+        data = []
+        for text in texts:
+            columns = []
+            values = []
+            numbers = []
+            for term, count in Counter(self._analyzer(text)).items():
+                for number, column, idf in self._postings.get(term, ()):
+                    numbers.append(number)
+                    columns.append(column)
+                    values.append(count * idf)
+
+            if columns:
+                numbers = np.array(numbers)
+                values = np.array(values)
+                norms = np.sqrt(np.bincount(numbers, weights=values ** 2, minlength=len(self.fields)))
+                values = values / norms[numbers] * scale[numbers]
+                indices.extend(columns)
+                data.extend(values.tolist())
+            indptr.append(len(indices))
+
+        vectors = sp.csr_matrix(
+            (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+            shape=(len(texts), self.n_features),
+        )
+        vectors.sort_indices()
+        vectors.eliminate_zeros()
+        return vectors
+
+    def normalize_fields(self, vectors):
+        """Scale each field block of every row to unit length, as transform() does for queries."""
+        vectors = sp.csr_matrix(vectors, dtype=np.float32, copy=True)
+        vectors.eliminate_zeros()
+        starts = np.array([self.offsets[f] for f in self.fields])
+        blocks = np.searchsorted(starts, vectors.indices, side='right') - 1
+        rows = np.repeat(np.arange(vectors.shape[0]), np.diff(vectors.indptr))
+        segments = rows * len(self.fields) + blocks
+        norms = np.sqrt(np.bincount(
+            segments, weights=vectors.data.astype(np.float64) ** 2, minlength=vectors.shape[0] * len(self.fields)
+        ))
+        vectors.data = (vectors.data / norms[segments]).astype(np.float32)
+        return vectors
+
+    def build_analyzer(self):
+        return self._analyzer
+
+    def __contains__(self, term):
+        """Whether any field's vocabulary has the term."""
+        return term in self._postings
+
+    def memory_usage(self):
+        """Approximate bytes held, summed over the field vectorizers plus the term lookup."""
+        usage = {'vocabulary': 0, 'idf': 0}
+        for vectorizer in self.vectorizers.values():
+            for part, nbytes in vectorizer_memory_usage(vectorizer).items():
+                usage[part] += nbytes
+        usage['postings'] = sys.getsizeof(self._postings) + sum(
+            sys.getsizeof(entries) + sum(sys.getsizeof(entry) + sys.getsizeof(entry[2]) for entry in entries)
+            for entries in self._postings.values()
+        )
+        return usage
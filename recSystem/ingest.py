@@ -0,0 +1,293 @@
+"""Streaming catalog ingestion for large perfume CSVs.
+
+Builds the same per-field TF-IDF index as app.py (see fields.py) without
+holding the catalog in memory. The CSV is read in chunks and vectorized in
+two passes:
+
+1. normalize rows, drop duplicates through a set of 64-bit row digests,
+   write the cleaned rows to disk and count document frequencies per field
+   and term
+2. re-read the cleaned rows and append their stacked TF-IDF rows to raw CSR
+   component files
+
+Peak memory is the chunk size and the vocabulary plus 8 bytes per unique
+row for the digests, which are kept as sorted numpy uint64 runs rather than
+Python ints. load_index() memory-maps the result.
+
+Every file is written under a temporary name and renamed into place once
+complete, meta.json last. A server that has the previous index mapped
+keeps reading the old files, so re-ingesting into a live index directory
+is safe and the change of meta.json marks the new index as ready.
+
+usage: python ingest.py perfumeData.csv index/ [--chunksize 50000]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from fields import FIELDS, FieldVectorizer, field_text
+
+CATALOG_COLUMNS = ['Name', 'Brand', 'Notes']
+DEFAULT_CHUNKSIZE = 50_000
+
+CATALOG_FILE = 'catalog.csv'
+META_FILE = 'meta.json'
+IDF_FILE = 'idf.npy'
+DATA_FILE = 'data.bin'
+INDICES_FILE = 'indices.bin'
+INDPTR_FILE = 'indptr.bin'
+
+DATA_DTYPE = np.float32
+INDEX_DTYPE = np.int32
+INDPTR_DTYPE = np.int64
+
+# suffix of files being written, renamed into place by _publish
+STAGING_SUFFIX = '.tmp'
+
+
+def normalize_chunk(chunk):
+    """Drop incomplete rows and collapse whitespace in every catalog field."""
+    chunk = chunk[CATALOG_COLUMNS].dropna().copy()
+    for col in CATALOG_COLUMNS:
+        chunk[col] = chunk[col].astype(str).str.split().str.join(' ')
+    return chunk[(chunk != '').all(axis=1)]
+
+
+def row_digest(row):
+    """Return a 64-bit digest of a normalized catalog row."""
+    key = '\x1f'.join(row).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def _staging(path):
+    return path + STAGING_SUFFIX
+
+
+def _publish(out_dir, names):
+    """Rename staged files into place in order.
+
+    os.replace swaps the directory entry only, so a process that still has
+    the old file mapped keeps its pages instead of seeing it truncated.
+    """
+    for name in names:
+        path = os.path.join(out_dir, name)
+        os.replace(_staging(path), path)
+
+
+class DigestSet:
+    """Set of 64-bit row digests held as sorted uint64 runs, 8 bytes per digest.
+
+    Each chunk's new digests become a sorted run; runs are merged whenever
+    the newer one is at least as large as the one before it, so there are
+    only O(log n) runs to search.
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    def contains(self, digests):
+        """Boolean mask of which digests are already in the set."""
+        found = np.zeros(len(digests), dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, digests), len(run) - 1)
+            found |= run[positions] == digests
+        return found
+
+    def add(self, digests):
+        """Add digests that are unique and not yet in the set."""
+        if not len(digests):
+            return
+        self.runs.append(np.sort(digests.astype(np.uint64)))
+        while len(self.runs) > 1 and len(self.runs[-2]) <= len(self.runs[-1]):
+            newer = self.runs.pop()
+            self.runs[-1] = np.sort(np.concatenate([self.runs[-1], newer]), kind='mergesort')
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    @property
+    def nbytes(self):
+        return sum(run.nbytes for run in self.runs)
+
+
+def _read_chunks(path, chunksize, encoding, **kwargs):
+    return pd.read_csv(path, chunksize=chunksize, encoding=encoding, dtype=str, **kwargs)
+
+
+def _count_pass(csv_path, catalog_path, chunksize, encoding):
+    """First pass: dedupe rows to catalog_path and count document frequencies per field."""
+    seen = DigestSet()
+    doc_freq = {field: Counter() for field in FIELDS}
+    n_docs = 0
+
+    header = True
+    for chunk in _read_chunks(csv_path, chunksize, encoding):
+        chunk = normalize_chunk(chunk)
+
+        digests = np.fromiter(
+            (row_digest(row) for row in chunk.itertuples(index=False, name=None)),
+            dtype=np.uint64, count=len(chunk),
+        )
+        # first occurrence within the chunk, and not seen in an earlier chunk
+        keep = np.zeros(len(chunk), dtype=bool)
+        keep[np.unique(digests, return_index=True)[1]] = True
+        keep &= ~seen.contains(digests)
+        seen.add(digests[keep])
+        chunk = chunk[keep]
+        if chunk.empty:
+            continue
+
+        for field in FIELDS:
+            counter = CountVectorizer(binary=True)
+            try:
+                counts = counter.fit_transform(field_text(chunk, field))
+            except ValueError:
+                # no terms in this field anywhere in the chunk
+                continue
+            chunk_df = np.asarray(counts.sum(axis=0)).ravel()
+            doc_freq[field].update(dict(zip(counter.get_feature_names_out(), chunk_df.tolist())))
+        n_docs += len(chunk)
+
+        chunk.to_csv(catalog_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+
+    return doc_freq, n_docs
+
+
+def _field_vectorizer(terms, idf):
+    """A fitted TfidfVectorizer from its sorted vocabulary and idf weights."""
+    vectorizer = TfidfVectorizer(
+        vocabulary={t: i for i, t in enumerate(terms)}, dtype=DATA_DTYPE
+    )
+    vectorizer.idf_ = idf
+    return vectorizer
+
+
+def _build_vectorizer(doc_freq, n_docs):
+    """Build a fitted FieldVectorizer from per-field document frequencies.
+
+    Matches TfidfVectorizer's defaults: sorted vocabulary and smoothed idf.
+    """
+    vectorizers = {}
+    for field in FIELDS:
+        terms = sorted(doc_freq[field])
+        df_counts = np.array([doc_freq[field][t] for t in terms], dtype=np.float64)
+        vectorizers[field] = _field_vectorizer(terms, np.log((1 + n_docs) / (1 + df_counts)) + 1)
+    return FieldVectorizer(vectorizers)
+
+
+def _weight_pass(catalog_path, out_dir, vectorizer, chunksize):
+    """Second pass: append the TF-IDF rows of every chunk to staged component files."""
+    nnz = 0
+    n_rows = 0
+    paths = [_staging(os.path.join(out_dir, f)) for f in (DATA_FILE, INDICES_FILE, INDPTR_FILE)]
+
+    with open(paths[0], 'wb') as data_f, open(paths[1], 'wb') as indices_f, \
+            open(paths[2], 'wb') as indptr_f:
+        np.zeros(1, dtype=INDPTR_DTYPE).tofile(indptr_f)
+
+        for chunk in _read_chunks(catalog_path, chunksize, 'utf-8', keep_default_na=False):
+            block = vectorizer.transform_documents(chunk)
+            block.sort_indices()
+
+            block.data.astype(DATA_DTYPE).tofile(data_f)
+            block.indices.astype(INDEX_DTYPE).tofile(indices_f)
+            (block.indptr[1:].astype(INDPTR_DTYPE) + nnz).tofile(indptr_f)
+
+            nnz += block.nnz
+            n_rows += block.shape[0]
+
+    return n_rows, nnz
+
+
+def ingest(csv_path, out_dir, chunksize=DEFAULT_CHUNKSIZE, encoding='ISO-8859-1'):
+    """Stream csv_path into an on-disk index in out_dir. Returns the matrix shape."""
+    os.makedirs(out_dir, exist_ok=True)
+    catalog_path = _staging(os.path.join(out_dir, CATALOG_FILE))
+
+    doc_freq, n_docs = _count_pass(csv_path, catalog_path, chunksize, encoding)
+    if not n_docs:
+        raise ValueError(f"No usable rows in {csv_path}")
+
+    vectorizer = _build_vectorizer(doc_freq, n_docs)
+    del doc_freq
+
+    n_rows, nnz = _weight_pass(catalog_path, out_dir, vectorizer, chunksize)
+    shape = (n_rows, vectorizer.n_features)
+
+    # idf weights of every field back to back, in stacked column order
+    fields = vectorizer.vectorizers
+    with open(_staging(os.path.join(out_dir, IDF_FILE)), 'wb') as f:
+        np.save(f, np.concatenate([v.idf_ for v in fields.values()]))
+    with open(_staging(os.path.join(out_dir, META_FILE)), 'w') as f:
+        json.dump({
+            'shape': shape,
+            'nnz': nnz,
+            'vocabulary': {field: v.get_feature_names_out().tolist() for field, v in fields.items()},
+        }, f)
+
+    # meta.json goes last, it is what load_index reads first and what the reload watcher polls
+    _publish(out_dir, [CATALOG_FILE, IDF_FILE, DATA_FILE, INDICES_FILE, INDPTR_FILE, META_FILE])
+    return shape
+
+
+def load_index(out_dir):
+    """Load an index written by ingest(). Returns (df, vectorizer, feature_vectors).
+
+    The matrix components are memory-mapped, so only the pages touched by
+    scoring are resident.
+    """
+    with open(os.path.join(out_dir, META_FILE)) as f:
+        meta = json.load(f)
+
+    if not isinstance(meta['vocabulary'], dict):
+        raise ValueError(f"{out_dir} predates per-field scoring, rebuild it with ingest.py")
+
+    idf = np.load(os.path.join(out_dir, IDF_FILE))
+    vectorizers = {}
+    start = 0
+    for field, terms in meta['vocabulary'].items():
+        vectorizers[field] = _field_vectorizer(terms, idf[start:start + len(terms)])
+        start += len(terms)
+    vectorizer = FieldVectorizer(vectorizers)
+
+    n_rows = meta['shape'][0]
+    data = np.memmap(os.path.join(out_dir, DATA_FILE), dtype=DATA_DTYPE, mode='r')
+    indices = np.memmap(os.path.join(out_dir, INDICES_FILE), dtype=INDEX_DTYPE, mode='r')
+    indptr = np.memmap(os.path.join(out_dir, INDPTR_FILE), dtype=INDPTR_DTYPE, mode='r')
+    if len(data) != meta['nnz'] or len(indices) != meta['nnz'] or len(indptr) != n_rows + 1:
+        # a load that raced a re-ingest, the next change of meta.json reloads again
+        raise ValueError(f"{out_dir} components do not match {META_FILE}, it is being rewritten")
+    feature_vectors = sp.csr_matrix(
+        (data, indices, indptr), shape=tuple(meta['shape']), copy=False
+    )
+
+    df = pd.read_csv(os.path.join(out_dir, CATALOG_FILE), dtype=str, keep_default_na=False)
+    if len(df) != n_rows:
+        raise ValueError(f"{CATALOG_FILE} has {len(df)} rows but the matrix has {n_rows}")
+
+    return df, vectorizer, feature_vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('csv_path')
+    parser.add_argument('out_dir')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--encoding', default='ISO-8859-1')
+    args = parser.parse_args()
+
+    shape = ingest(args.csv_path, args.out_dir, args.chunksize, args.encoding)
+    print(f"wrote {shape[0]} rows x {shape[1]} field terms to {args.out_dir}")
+
+
+if __name__ == '__main__':
+    main()
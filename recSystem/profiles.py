@@ -0,0 +1,94 @@
+"""Per-user taste profiles built from favorited perfumes.
+
+A profile is the mean of the TF-IDF rows of a user's favorites with each
+field block normalized, so it scores like a query (see fields.py).
+Profiles are cached per user key together with a fingerprint of the
+favorites they were built from, so a changed favorites list rebuilds the
+profile on the next request.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sp
+
+from catalog import matrix_memory_usage, object_nbytes
+from facets import name_key
+
+DEFAULT_CACHE_SIZE = 10_000
+
+
+def favorites_fingerprint(favorites):
+    """Order-insensitive fingerprint of a favorites list."""
+    keys = sorted({name_key(name) for name in favorites})
+    return hashlib.blake2b('\x1f'.join(keys).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def build_profile(vectorizer, matrix, rows):
+    """Mean of the given matrix rows, each field block normalized, as a 1 x n_features CSR row."""
+    profile = sp.csr_matrix(matrix[rows].mean(axis=0))
+    return vectorizer.normalize_fields(profile.astype(matrix.dtype))
+
+
+class ProfileCache:
+    """Thread-safe LRU cache of (fingerprint, rows, profile) per user key."""
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user, fingerprint):
+        """Return the cached (rows, profile) if the favorites are unchanged."""
+        with self._lock:
+            entry = self._entries.get(user)
+            if entry is None or entry[0] != fingerprint:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, user, fingerprint, rows, profile):
+        with self._lock:
+            self._entries[user] = (fingerprint, rows, profile)
+            self._entries.move_to_end(user)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def memory_usage(self):
+        """Approximate bytes held by the cached users, favorite rows and profile vectors."""
+        with self._lock:
+            return {
+                'keys': object_nbytes({user: entry[0] for user, entry in self._entries.items()}),
+                'rows': sum(object_nbytes(entry[1]) for entry in self._entries.values()),
+                'profiles': sum(sum(matrix_memory_usage(entry[2]).values()) for entry in self._entries.values()),
+            }
+
+    def invalidate(self, user=None):
+        """Drop one user's profile, or every profile when user is None."""
+        with self._lock:
+            if user is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def resolve_favorites(facets, favorites):
+    """Map favorite names to catalog rows. Returns (rows, unresolved names)."""
+    rows = []
+    unresolved = []
+    for name in favorites:
+        found = facets.name_rows(name)
+        if len(found):
+            rows.extend(found.tolist())
+        else:
+            unresolved.append(name)
+    return np.unique(np.asarray(rows, dtype=np.intp)), unresolved
@@ -0,0 +1,118 @@
+"""Cached /recommend results and warming them from the query log.
+
+Queries are normalized to their sorted in-vocabulary terms before they are
+cached or logged. The normalized query vectorizes exactly like the raw
+input, so it is a safe cache key, and words outside the catalog vocabulary
+(typos and words no catalog entry uses) never reach the log. Filters are
+logged only as catalog brands and notes; perfume names (exclude_name
+usually lists a user's favorites) and values outside the catalog are
+dropped.
+"""
+
+import threading
+from collections import OrderedDict
+
+from catalog import object_nbytes
+from facets import name_key
+
+DEFAULT_CACHE_SIZE = 10_000
+
+
+def normalize_query(vectorizer, notes):
+    """Sorted in-vocabulary terms of a query, space separated."""
+    analyzer = vectorizer.build_analyzer()
+    return ' '.join(sorted(term for term in analyzer(notes) if term in vectorizer))
+
+
+def normalize_filters(filters):
+    """Filter values normalized the way facet lookups compare them, sorted and deduplicated.
+
+    Blank values (an empty search box) are dropped, and so is a filter left without values.
+    """
+    normalized = {param: sorted({name_key(v) for v in values} - {''}) for param, values in filters.items()}
+    return {param: values for param, values in normalized.items() if values}
+
+
+def loggable_filters(facets, filters):
+    """The part of normalized filters that may be logged: catalog brands and notes only."""
+    known = {'brand': facets.brand_keys, 'exclude_brand': facets.brand_keys, 'exclude_note': facets.note_keys}
+    logged = {}
+    for param, values in filters.items():
+        values = [v for v in values if v in known.get(param, ())]
+        if values:
+            logged[param] = values
+    return logged
+
+
+def result_key(query, n, filters, weights=None):
+    """Cache key for a normalized query, result count, filters and field weight overrides."""
+    return (
+        query,
+        n,
+        tuple(sorted((name, tuple(sorted(values))) for name, values in filters.items() if values)),
+        tuple(sorted((weights or {}).items())),
+    )
+
+
+class ResultCache:
+    """Thread-safe LRU cache of (indices, scores) per result key."""
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, indices, scores):
+        with self._lock:
+            self._entries[key] = (indices, scores)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def memory_usage(self):
+        """Approximate bytes held by the cached keys and results."""
+        with self._lock:
+            return {
+                'keys': object_nbytes(list(self._entries)),
+                'results': sum(object_nbytes(entry) for entry in self._entries.values()),
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def warm_up(entries, vectorizer, scorer, mask_for, cache):
+    """Score logged queries into the cache. Returns the number of results cached.
+
+    entries are query log records ({'q', 'n', 'filters', 'weights'}); queries
+    sharing field weights are vectorized in one batch, then scored one by one
+    under their own filters.
+    """
+    batches = {}
+    for entry in entries:
+        if entry.get('q'):
+            batches.setdefault(tuple(sorted(entry.get('weights', {}).items())), []).append(entry)
+
+    for weights, batch in batches.items():
+        vectors = vectorizer.transform([entry['q'] for entry in batch], dict(weights))
+        for i, entry in enumerate(batch):
+            filters = entry.get('filters', {})
+            indices, scores = scorer.top_k(vectors[i], entry['n'], mask=mask_for(filters))
+            cache.put(result_key(entry['q'], entry['n'], filters, dict(weights)), indices, scores)
+    return sum(len(batch) for batch in batches.values())
@@ -0,0 +1,110 @@
+"""Blocked top-k scoring over the TF-IDF feature matrix.
+
+The matrix is split into row shards once at startup. Each query scores the
+shards in parallel on a thread pool (the scipy sparse kernels release the
+GIL), keeps a local top-k per shard and merges the candidates.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+
+DEFAULT_SHARDS = int(os.getenv('RECOMMEND_SHARDS', '1'))
+
+
+def _local_top_k(scores, k):
+    """Return the indices of the k highest scores, unordered.
+
+    Rows tied with the k-th score are taken in row order, so every shard
+    keeps its best k under (score, row) and the merged result does not
+    depend on how the rows were sharded.
+    """
+    if k >= scores.shape[0]:
+        return np.arange(scores.shape[0])
+    kth = np.partition(scores, -k)[-k]
+    above = np.flatnonzero(scores > kth)
+    tied = np.flatnonzero(scores == kth)[:k - len(above)]
+    return np.concatenate([above, tied])
+
+
+def _row_block(matrix, start, end):
+    """View rows [start, end) of a CSR matrix without copying data or indices."""
+    lo, hi = matrix.indptr[start], matrix.indptr[end]
+    return sp.csr_matrix(
+        (matrix.data[lo:hi], matrix.indices[lo:hi], matrix.indptr[start:end + 1] - lo),
+        shape=(end - start, matrix.shape[1]), copy=False,
+    )
+
+
+class BlockedScorer:
+    """Scores a query against a row-sharded sparse matrix.
+
+    Rows of the matrix are expected to be L2-normalized (the TfidfVectorizer
+    default), so the dot product with a normalized query is the cosine
+    similarity.
+    """
+
+    def __init__(self, matrix, shards=DEFAULT_SHARDS):
+        n_rows = matrix.shape[0]
+        self.n_rows = n_rows
+        self.dtype = matrix.dtype
+        self.shards = max(1, min(shards, n_rows or 1))
+
+        bounds = np.linspace(0, n_rows, self.shards + 1, dtype=int)
+        self.blocks = [
+            (int(start), _row_block(matrix, start, end))
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+
+        self._executor = None
+        if self.shards > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.shards, thread_name_prefix='scorer'
+            )
+
+    def _score_block(self, offset, block, query, k, mask):
+        """Score one shard and return its local top-k as global indices."""
+        scores = block @ query
+        if mask is not None:
+            scores[~mask[offset:offset + block.shape[0]]] = -np.inf
+        local = _local_top_k(scores, k)
+        return local + offset, scores[local]
+
+    def top_k(self, query_vector, k, mask=None):
+        """Return (indices, scores) of the k best rows, best first.
+
+        mask is an optional boolean array over rows; rows where it is False
+        are never selected.
+        """
+        k = min(k, self.n_rows)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        query = query_vector.toarray().ravel().astype(self.dtype, copy=False)
+
+        if self._executor is None:
+            parts = [self._score_block(offset, block, query, k, mask)
+                     for offset, block in self.blocks]
+        else:
+            futures = [
+                self._executor.submit(self._score_block, offset, block, query, k, mask)
+                for offset, block in self.blocks
+            ]
+            parts = [f.result() for f in futures]
+
+        indices = np.concatenate([p[0] for p in parts])
+        scores = np.concatenate([p[1] for p in parts])
+
+        # best score first, ties broken by row order (each shard kept its lowest tied rows)
+        order = np.lexsort((indices, -scores))[:k]
+        if mask is not None:
+            order = order[np.isfinite(scores[order])]
+        return indices[order], scores[order]
+
+    def close(self):
+        """Shut down the shard thread pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
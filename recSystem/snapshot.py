@@ -0,0 +1,170 @@
+"""Immutable index snapshots and their hot reload.
+
+A snapshot bundles everything a request reads: the catalog, the fitted
+vectorizer, the TF-IDF matrix and the indexes and caches derived from
+them. Only a snapshot's caches change after it is built. A reload builds
+and warms a complete new snapshot in the background, then swaps it in by
+rebinding `IndexManager.current`, which is atomic. Requests pin the
+snapshot they started with, so a reload never mixes versions within a
+request. An old snapshot is freed once the last request holding it
+finishes.
+"""
+
+import os
+import threading
+import time
+import weakref
+
+import pandas as pd
+
+from catalog import Catalog, compact_matrix
+from facets import FacetIndex
+from fields import FieldVectorizer
+from ingest import META_FILE, load_index
+from profiles import ProfileCache
+from results import ResultCache, warm_up
+from scoring import BlockedScorer
+from typeahead import PrefixIndex
+
+# query parameter -> FacetIndex.mask argument
+FILTER_PARAMS = {
+    'brand': 'brands',
+    'exclude_brand': 'exclude_brands',
+    'exclude_note': 'exclude_notes',
+    'exclude_name': 'exclude_names',
+}
+
+
+def source_path(csv_path, index_dir=''):
+    """The file whose modification marks a new catalog (ingest.py writes meta.json last)."""
+    return os.path.join(index_dir, META_FILE) if index_dir else csv_path
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class IndexSnapshot:
+    """One version of the catalog and every index built from it."""
+
+    def __init__(self, catalog, vectorizer, feature_vectors, version=1, source_mtime=None):
+        self.version = version
+        self.source_mtime = source_mtime
+        self.catalog = catalog
+        self.vectorizer = vectorizer
+        self.feature_vectors = feature_vectors
+
+        # shard the matrix once so each query can be scored across cores
+        self.scorer = BlockedScorer(feature_vectors)
+        # brand/note/name postings for filtered queries
+        self.facets = FacetIndex(catalog)
+        # prefix completions for the search box
+        self.typeahead = PrefixIndex.from_catalog(catalog, vectorizer, feature_vectors)
+
+        # profiles and results are row ids into this snapshot, so they live and die with it
+        self.profiles = ProfileCache()
+        self.results = ResultCache()
+
+        # the shard pool goes when the last reader lets go of the snapshot
+        weakref.finalize(self, self.scorer.close)
+
+    @classmethod
+    def load(cls, csv_path, index_dir='', version=1):
+        """Build a snapshot from a prebuilt ingest.py index or from the catalog CSV."""
+        # read the mtime first, so a change during the build triggers another reload
+        source_mtime = _mtime(source_path(csv_path, index_dir))
+
+        if index_dir:
+            df, vectorizer, feature_vectors = load_index(index_dir)
+        else:
+            df = pd.read_csv(csv_path, encoding='ISO-8859-1')
+            df.drop_duplicates(inplace=True)
+            df.dropna(inplace=True)
+
+            # extract needed features, one TF-IDF block per field
+            vectorizer, feature_vectors = FieldVectorizer.fit(df)
+
+        # keep only the compact representation, the DataFrame is dropped here
+        catalog = Catalog.from_frame(df)
+        return cls(catalog, vectorizer, compact_matrix(feature_vectors), version, source_mtime)
+
+    def filter_mask(self, filters, exclude_rows=()):
+        """Build the row mask for a set of filters keyed by query parameter."""
+        return self.facets.mask(
+            exclude_rows=exclude_rows,
+            **{FILTER_PARAMS[param]: values for param, values in filters.items()}
+        )
+
+    def warm(self, entries):
+        """Score logged queries into this snapshot's result cache."""
+        return warm_up(entries, self.vectorizer, self.scorer, self.filter_mask, self.results)
+
+
+class IndexManager:
+    """Holds the current snapshot and swaps in rebuilt ones without blocking readers."""
+
+    def __init__(self, csv_path, index_dir='', prepare=None):
+        self.csv_path = csv_path
+        self.index_dir = index_dir
+        # called with each rebuilt snapshot before it goes live, e.g. to warm its caches
+        self.prepare = prepare
+        self.reloads = 0
+        self._reload_lock = threading.Lock()
+        self._live = weakref.WeakSet()
+        self.current = self._track(IndexSnapshot.load(csv_path, index_dir))
+
+    def _track(self, snapshot):
+        self._live.add(snapshot)
+        return snapshot
+
+    @property
+    def live_snapshots(self):
+        """Snapshots still referenced, by the manager or by in-flight requests."""
+        return len(self._live)
+
+    def reload(self):
+        """Build, prepare and swap in a new snapshot. Returns None if a reload is already running."""
+        if not self._reload_lock.acquire(blocking=False):
+            return None
+        try:
+            snapshot = IndexSnapshot.load(self.csv_path, self.index_dir, self.current.version + 1)
+            if self.prepare is not None:
+                self.prepare(snapshot)
+            self.current = self._track(snapshot)
+            self.reloads += 1
+            return snapshot
+        finally:
+            self._reload_lock.release()
+
+    def reload_in_background(self):
+        """Start a reload on its own thread unless one is already running."""
+        if self._reload_lock.locked():
+            return False
+        threading.Thread(target=self._reload_logged, daemon=True).start()
+        return True
+
+    def _reload_logged(self):
+        try:
+            snapshot = self.reload()
+            if snapshot is not None:
+                print(f"Reloaded index as version {snapshot.version} ({len(snapshot.catalog)} rows)")
+        except Exception as e:
+            # keep serving the current snapshot
+            print(f"Index reload failed: {e}")
+
+    def watch(self, interval):
+        """Poll the catalog source every interval seconds and reload when it changes."""
+        def run():
+            # a source that failed to load is not retried until it changes again
+            attempted = self.current.source_mtime
+            while True:
+                time.sleep(interval)
+                mtime = _mtime(source_path(self.csv_path, self.index_dir))
+                if mtime is not None and mtime != attempted:
+                    attempted = mtime
+                    self._reload_logged()
+
+        threading.Thread(target=run, daemon=True).start()
@@ -1,6 +1,31 @@
+import gzip
+import os
 import pytest
 import json
-from app import app, df, vectorizer, feature_vectors
+import pstats
+import numpy as np
+import pandas as pd
+from flask import Flask
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+import app as app_module
+from app import app, index
+from catalog import Catalog
+from profiles import build_profile
+from shared.profiling import RequestProfiler, phase
+from fields import FieldVectorizer
+from ingest import ingest, load_index
+from shared import negotiation
+from shared.querylog import QueryLog
+from results import ResultCache, normalize_query, result_key, warm_up
+from scoring import BlockedScorer
+from typeahead import PrefixIndex
+
+# the snapshot served at startup, reload tests build their own IndexManager
+snapshot = index.current
+catalog, vectorizer, feature_vectors = snapshot.catalog, snapshot.vectorizer, snapshot.feature_vectors
+facets, typeahead_index = snapshot.facets, snapshot.typeahead
+profile_cache, result_cache = snapshot.profiles, snapshot.results
 
 
 @pytest.fixture
@@ -82,31 +107,91 @@ class TestDataIntegrity:
 
     def test_dataset_loaded(self):
         """test that the perfume dataset is loaded correctly."""
-        assert df is not None
-        assert len(df) > 0
+        assert catalog is not None
+        assert len(catalog) > 0
 
     def test_dataset_has_required_columns(self):
         """test that the dataset has all required columns."""
         required_columns = ['Name', 'Brand', 'Notes']
+        record = catalog.record(0)
         for col in required_columns:
-            assert col in df.columns
+            assert col in catalog.columns
+            assert col in record
 
     def test_no_duplicates_in_dataset(self):
         """test that duplicates were removed during preprocessing."""
-        assert len(df) == len(df.drop_duplicates())
+        source = pd.read_csv('perfumeData.csv', encoding='ISO-8859-1')
+        assert len(catalog) == len(source.drop_duplicates().dropna())
 
     def test_no_null_values(self):
         """test that null values were removed during preprocessing."""
-        assert df.isnull().sum().sum() == 0
+        for record in catalog.records(range(len(catalog))):
+            assert all(isinstance(v, str) for v in record.values())
 
     def test_vectorizer_fitted(self):
         """test that the TF-IDF vectorizer is properly fitted."""
         assert vectorizer is not None
-        assert hasattr(vectorizer, 'vocabulary_')
+        assert all(hasattr(v, 'vocabulary_') for v in vectorizer.vectorizers.values())
 
     def test_feature_vectors_shape(self):
         """test that feature vectors have correct dimensions."""
-        assert feature_vectors.shape[0] == len(df)
+        assert feature_vectors.shape[0] == len(catalog)
+
+
+class TestCompactCatalog:
+    """tests for the interned catalog and compact matrix."""
+
+    def test_records_round_trip(self):
+        """test that decoded records match the source rows exactly."""
+        source = pd.read_csv('perfumeData.csv', encoding='ISO-8859-1')
+        source = source.drop_duplicates().dropna()
+        compact = Catalog.from_frame(source)
+
+        assert compact.records(range(len(source))) == source[Catalog.columns].to_dict('records')
+
+    def test_brands_and_notes_interned(self):
+        """test that repeated brands and notes share one table entry."""
+        frame = pd.DataFrame({
+            'Name': ['Alpha', 'Beta', 'Gamma'],
+            'Brand': ['House', 'Maison', 'House'],
+            'Notes': [' vanilla, musk', 'musk, rose', 'rose'],
+        })
+        compact = Catalog.from_frame(frame)
+
+        assert sorted(compact.brands) == ['House', 'Maison']
+        assert compact.brand_codes[0] == compact.brand_codes[2]
+        assert compact.notes == ['vanilla', 'musk', 'rose']
+        assert list(compact.row_note_ids(1)) == [1, 2]
+        assert compact.note_ids.dtype == np.int32
+
+    def test_matrix_is_compact(self):
+        """test that the served matrix uses float32 data and int32 indices."""
+        assert feature_vectors.dtype == np.float32
+        assert feature_vectors.indices.dtype == np.int32
+        assert feature_vectors.indptr.dtype == np.int32
+
+    def test_memory_report(self, client):
+        """test that the memory endpoint breaks bytes down per component."""
+        response = client.get('/memory')
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['rows'] == len(catalog)
+        assert data['components']['feature_vectors']['data'] == feature_vectors.data.nbytes
+        assert 'note_ids' in data['components']['catalog']
+        assert data['total_bytes'] == sum(data['totals'].values())
+
+    def test_memory_report_covers_snapshot_indexes(self, client):
+        """test that facets, typeahead and both caches are counted in the memory report."""
+        client.get('/recommend?notes=vanilla+amber&n=4')
+        client.get(f'/recommend/favorites?user=memory-test&favorite={catalog.name(7)}')
+        components = client.get('/memory').get_json()['components']
+
+        assert components['facets']['name_hashes'] == facets.name_hashes.nbytes
+        assert components['typeahead']['keys'] == typeahead_index.keys.nbytes
+        assert components['typeahead']['precomputed'] > 0
+        assert components['result_cache']['results'] > 0
+        assert components['profile_cache']['profiles'] > 0
 
 
 class TestCORS:
@@ -118,3 +203,693 @@ class TestCORS:
 
         # check for CORS header
         assert response.status_code == 200
+
+
+class TestBlockedScorer:
+    """tests for sharded top-k scoring."""
+
+    def test_sharded_matches_single_shard(self):
+        """test that sharding does not change the ranking."""
+        query = vectorizer.transform(['vanilla musk'])
+        expected, expected_scores = BlockedScorer(feature_vectors, shards=1).top_k(query, 10)
+
+        scorer = BlockedScorer(feature_vectors, shards=4)
+        indices, scores = scorer.top_k(query, 10)
+        scorer.close()
+
+        assert list(indices) == list(expected)
+        assert np.allclose(scores, expected_scores)
+
+    def test_scores_match_full_product(self):
+        """test that blocked scores equal the full matrix product."""
+        query = vectorizer.transform(['rose jasmine'])
+        full = (feature_vectors @ query.T).toarray().ravel()
+
+        scorer = BlockedScorer(feature_vectors, shards=3)
+        indices, scores = scorer.top_k(query, 5)
+        scorer.close()
+
+        assert np.allclose(scores, np.sort(full)[::-1][:5])
+        assert np.allclose(full[indices], scores)
+
+    @pytest.mark.parametrize('shards', [3, 7])
+    def test_ties_independent_of_sharding(self, shards):
+        """test that a filtered query with mostly tied zero scores gives the same rows at any shard count."""
+        query = vectorizer.transform(['vanilla'])
+        mask = facets.mask(brands=['Montale'])
+        expected, expected_scores = BlockedScorer(feature_vectors, shards=1).top_k(query, 30, mask=mask)
+
+        scorer = BlockedScorer(feature_vectors, shards=shards)
+        indices, scores = scorer.top_k(query, 30, mask=mask)
+        scorer.close()
+
+        assert (expected_scores == 0).sum() > 0
+        assert list(indices) == list(expected)
+        assert np.array_equal(scores, expected_scores)
+        # ties come back in row order
+        tied = expected[expected_scores == 0]
+        assert list(tied) == sorted(tied)
+
+    def test_k_larger_than_catalog(self):
+        """test that k is capped at the number of rows."""
+        query = vectorizer.transform(['citrus'])
+        indices, _ = BlockedScorer(feature_vectors[:7], shards=2).top_k(query, 50)
+
+        assert len(indices) == 7
+        assert sorted(indices) == list(range(7))
+
+
+class TestStreamingIngest:
+    """tests for chunked two-pass catalog ingestion."""
+
+    def test_matches_in_memory_fit(self, tmp_path):
+        """test that chunked ingestion matches fitting the cleaned catalog at once."""
+        shape = ingest('perfumeData.csv', str(tmp_path), chunksize=300)
+        frame, streamed_vectorizer, streamed_vectors = load_index(str(tmp_path))
+
+        expected_vectorizer, expected = FieldVectorizer.fit(frame)
+
+        assert streamed_vectors.shape == shape == expected.shape
+        for field, expected_field in expected_vectorizer.vectorizers.items():
+            assert streamed_vectorizer.vectorizers[field].vocabulary_ == expected_field.vocabulary_
+        assert abs(streamed_vectors - expected).max() < 1e-6
+
+    def test_duplicates_removed_across_chunks(self, tmp_path):
+        """test that rows repeated in later chunks are dropped."""
+        source = tmp_path / 'dupes.csv'
+        source.write_text(
+            'Name,Brand,Notes\n'
+            'Alpha,House,vanilla\n'
+            'Beta,House," rose,  jasmine"\n'
+            'Alpha,House,vanilla\n'
+            'Beta , House,"rose, jasmine"\n'
+            'Gamma,House,\n'
+        )
+        out_dir = tmp_path / 'index'
+        ingest(str(source), str(out_dir), chunksize=2)
+        frame, _, vectors = load_index(str(out_dir))
+
+        assert list(frame['Name']) == ['Alpha', 'Beta']
+        assert vectors.shape[0] == 2
+
+    def test_digest_set_is_compact(self):
+        """test that row digests dedupe across many chunks at 8 bytes each."""
+        from ingest import DigestSet
+        rng = np.random.default_rng(0)
+        values = rng.integers(0, 2**63, size=5000, dtype=np.uint64)
+        seen = DigestSet()
+
+        for chunk in np.array_split(values, 37):
+            seen.add(chunk[~seen.contains(chunk)])
+
+        assert seen.contains(values).all()
+        assert not seen.contains(values + np.uint64(1)).any()
+        assert len(seen) == len(np.unique(values)) and seen.nbytes == 8 * len(seen)
+        assert len(seen.runs) <= 6
+
+    def test_streamed_index_serves_queries(self, tmp_path):
+        """test that the loaded index scores like the in-memory one."""
+        ingest('perfumeData.csv', str(tmp_path), chunksize=500)
+        frame, streamed_vectorizer, streamed_vectors = load_index(str(tmp_path))
+
+        query = streamed_vectorizer.transform(['vanilla musk'])
+        indices, scores = BlockedScorer(streamed_vectors).top_k(query, 3)
+
+        assert len(indices) == 3
+        assert scores[0] > 0
+        assert 'vanilla' in frame.iloc[indices[0]]['Notes'].lower()
+
+    def test_reingest_keeps_loaded_index_readable(self, tmp_path):
+        """test that re-ingesting into a loaded index directory leaves the mapped snapshot intact."""
+        from snapshot import IndexSnapshot
+        source = tmp_path / 'feed.csv'
+        frame = pd.read_csv('perfumeData.csv', encoding='ISO-8859-1')
+        frame.head(300).to_csv(source, index=False, encoding='ISO-8859-1')
+        out_dir = str(tmp_path / 'index')
+        ingest(str(source), out_dir)
+
+        loaded = IndexSnapshot.load(str(source), out_dir)
+        query = loaded.vectorizer.transform(['vanilla musk'])
+        before = loaded.scorer.top_k(query, 5)
+
+        frame.head(50).to_csv(source, index=False, encoding='ISO-8859-1')
+        ingest(str(source), out_dir)
+
+        after = loaded.scorer.top_k(query, 5)
+        assert np.array_equal(before[0], after[0]) and np.allclose(before[1], after[1])
+        assert (loaded.feature_vectors @ query.T).shape[0] == len(loaded.catalog)
+        assert load_index(out_dir)[2].shape[0] < len(loaded.catalog)
+        assert not [name for name in os.listdir(out_dir) if name.endswith('.tmp')]
+
+
+class TestFilteredRecommendations:
+    """tests for brand, note and name filters on /recommend."""
+
+    def test_brand_include(self, client):
+        """test that only the requested brand is returned, still n results."""
+        brand = catalog.brand(0)
+        response = client.get('/recommend', query_string={'notes': 'vanilla', 'brand': brand.lower(), 'n': 2})
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        expected = min(2, len(facets.brand_rows(brand)))
+        assert len(data) == expected
+        assert all(r['Brand'] == brand for r in data)
+
+    @pytest.mark.parametrize('blank', ['', '%20'])
+    def test_blank_filter_ignored(self, client, blank):
+        """test that an empty filter box filters nothing on either endpoint."""
+        unfiltered = client.get('/recommend?notes=vanilla&n=3').get_json()
+        filtered = client.get(f'/recommend?notes=vanilla&n=3&brand={blank}&exclude_note={blank}').get_json()
+        favorites = client.get(f'/recommend/favorites?favorite={catalog.name(7)}&n=3&brand={blank}')
+
+        assert filtered == unfiltered and len(filtered) == 3
+        assert favorites.status_code == 200 and len(favorites.get_json()) == 3
+
+    def test_exclude_brand_and_name(self, client):
+        """test that excluded brands and names are skipped but n is kept."""
+        unfiltered = json.loads(client.get('/recommend?notes=vanilla+musk&n=5').data)
+        top = unfiltered[0]
+
+        response = client.get('/recommend', query_string=[
+            ('notes', 'vanilla musk'), ('n', 5),
+            ('exclude_brand', top['Brand']), ('exclude_name', unfiltered[1]['Name']),
+        ])
+        data = json.loads(response.data)
+
+        assert len(data) == 5
+        assert all(r['Brand'] != top['Brand'] for r in data)
+        assert all(r['Name'] != unfiltered[1]['Name'] for r in data)
+
+    def test_exclude_note(self, client):
+        """test that perfumes listing an excluded note are skipped."""
+        response = client.get('/recommend?notes=vanilla&exclude_note=vanilla&n=10')
+        data = json.loads(response.data)
+
+        assert len(data) == 10
+        for r in data:
+            assert 'vanilla' not in [n.strip().lower() for n in r['Notes'].split(',')]
+
+    def test_unknown_brand_returns_empty(self, client):
+        """test that an include filter with no matching rows returns nothing."""
+        response = client.get('/recommend?notes=vanilla&brand=No+Such+House')
+
+        assert response.status_code == 200
+        assert json.loads(response.data) == []
+
+    def test_mask_matches_post_filter(self):
+        """test that masked top-k equals ranking everything then filtering."""
+        query = vectorizer.transform(['rose jasmine'])
+        mask = facets.mask(exclude_notes=['rose'])
+        indices, _ = BlockedScorer(feature_vectors).top_k(query, 8, mask=mask)
+
+        full = (feature_vectors @ query.T).toarray().ravel()
+        ranked = [i for i in np.lexsort((np.arange(len(full)), -full)) if mask[i]]
+        assert list(indices) == ranked[:8]
+
+    def test_name_lookup(self):
+        """test that the hashed name index finds rows case-insensitively."""
+        name = catalog.name(5)
+        rows = facets.name_rows('  ' + name.upper() + ' ')
+
+        assert 5 in rows
+        assert all(catalog.name(r).lower() == name.lower() for r in rows)
+        assert len(facets.name_rows('definitely not a perfume')) == 0
+
+
+class TestFavoritesRecommendations:
+    """tests for profile-based recommendations from favorites."""
+
+    def test_returns_n_results_excluding_favorites(self, client):
+        """test that favorites are never recommended back."""
+        favorites = [catalog.name(0), catalog.name(1)]
+        response = client.get('/recommend/favorites',
+                              query_string=[('favorite', f) for f in favorites] + [('n', 5)])
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert len(data) == 5
+        assert not {r['Name'].lower() for r in data} & {f.lower() for f in favorites}
+
+    def test_missing_favorites_returns_error(self, client):
+        """test that a request without favorites returns 400."""
+        response = client.get('/recommend/favorites')
+
+        assert response.status_code == 400
+        assert 'error' in json.loads(response.data)
+
+    def test_unknown_favorites_returns_404(self, client):
+        """test that favorites missing from the catalog are reported."""
+        response = client.get('/recommend/favorites?favorite=Not+A+Real+Perfume')
+
+        assert response.status_code == 404
+        assert json.loads(response.data)['unresolved'] == ['Not A Real Perfume']
+
+    def test_profile_cached_and_invalidated_on_change(self, client):
+        """test that the profile is reused until the favorites change."""
+        profile_cache.invalidate()
+        first = [('user', 'a@example.com'), ('favorite', catalog.name(3))]
+
+        client.get('/recommend/favorites', query_string=first)
+        hits = profile_cache.hits
+        client.get('/recommend/favorites', query_string=first)
+        assert profile_cache.hits == hits + 1
+
+        changed = first + [('favorite', catalog.name(4))]
+        misses = profile_cache.misses
+        data = json.loads(client.get('/recommend/favorites', query_string=changed).data)
+        assert profile_cache.misses == misses + 1
+        assert catalog.name(4) not in {r['Name'] for r in data}
+
+        client.delete('/recommend/favorites/a@example.com')
+        assert len(profile_cache) == 0
+
+    def test_profile_is_mean_of_favorite_rows(self):
+        """test that the profile ranks the favorites' own rows highest."""
+        profile = build_profile(vectorizer, feature_vectors, np.array([7]))
+        indices, scores = BlockedScorer(feature_vectors).top_k(profile, 1)
+
+        # every field block of the row matches itself with cosine 1
+        assert np.isclose(scores[0], len(vectorizer.fields), atol=1e-5)
+        assert catalog.name(indices[0]).lower() == catalog.name(7).lower()
+
+    def test_favorites_score_weighted_field_cosines(self):
+        """test that favorites scores are the weighted sum of per-field cosines with the mean profile."""
+        from sklearn.preprocessing import normalize
+        rows = np.array([7, 40, 300])
+        weights = {'Name': 0.2, 'Brand': 0.5, 'Notes': 1.5}
+        profile = vectorizer.weigh(build_profile(vectorizer, feature_vectors, rows), weights)
+
+        scores = (feature_vectors @ profile.T).toarray().ravel()
+
+        mean = np.asarray(feature_vectors[rows].mean(axis=0))
+        expected = np.zeros(feature_vectors.shape[0])
+        for field in vectorizer.fields:
+            block = slice(vectorizer.offsets[field], vectorizer.offsets[field] + vectorizer.sizes[field])
+            expected += weights[field] * feature_vectors[:, block] @ normalize(mean[:, block]).ravel()
+        assert np.allclose(scores, expected, atol=1e-5)
+
+
+class TestTypeahead:
+    """tests for prefix completions."""
+
+    def test_completes_notes_by_frequency(self, client):
+        """test that the most frequent completion comes first."""
+        response = client.get('/typeahead?q=Van&n=3')
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert len(data) == 3
+        assert data[0] == {'text': 'vanilla', 'type': 'note', 'count': data[0]['count']}
+        assert [r['count'] for r in data] == sorted((r['count'] for r in data), reverse=True)
+        assert all(r['text'].lower().startswith('van') for r in data)
+
+    def test_completes_names_and_brands(self):
+        """test that perfume names and brands are indexed."""
+        name = catalog.name(0)
+        brand = catalog.brand(0)
+
+        assert name in [r['text'] for r in typeahead_index.complete(name, 20) if r['type'] == 'name']
+        assert brand in [r['text'] for r in typeahead_index.complete(brand, 20) if r['type'] == 'brand']
+
+    def test_long_prefix_matches_short_prefix_ranking(self):
+        """test that precomputed and searched prefixes rank consistently."""
+        short = [r for r in typeahead_index.complete('ro', 20) if r['text'].lower().startswith('ros')]
+        longer = typeahead_index.complete('ros', 20)
+
+        assert longer[:len(short)] == short
+
+    def test_empty_and_unknown_prefix(self, client):
+        """test that empty or unknown prefixes return no completions."""
+        assert json.loads(client.get('/typeahead?q=').data) == []
+        assert json.loads(client.get('/typeahead?q=qqqzzz').data) == []
+
+    def test_ranking_within_index(self):
+        """test ranking by count, then length, then key on a small index."""
+        index = PrefixIndex([
+            ('Rose', 'note', 3), ('rosewood', 'note', 3), ('Rosa', 'brand', 9), ('rose', 'note', 2),
+        ])
+        texts = [r['text'] for r in index.complete('ros')]
+
+        assert texts == ['Rosa', 'Rose', 'rosewood']
+        assert index.complete('rose', 1) == [{'text': 'Rose', 'type': 'note', 'count': 5}]
+
+    def test_keys_packed_like_catalog_names(self):
+        """test that keys and texts live in UTF-8 buffers and still bisect correctly."""
+        keys = typeahead_index.keys
+        packed_bytes = sum(len(keys[i].encode('utf-8')) for i in range(len(keys)))
+
+        assert keys.buffer.nbytes == packed_bytes
+        assert [keys[i] for i in range(len(keys))] == sorted(keys[i] for i in range(len(keys)))
+        assert typeahead_index.complete('qzxv', 5) == []
+        assert typeahead_index.complete('q', 5) == typeahead_index.complete('Q', 5)
+
+
+class TestRequestProfiling:
+    """tests for opt-in per-phase timing and sampled captures."""
+
+    @pytest.fixture
+    def profiled(self, tmp_path):
+        """a small app with the profiler installed, writing to tmp_path."""
+        profiled_app = Flask(__name__)
+        RequestProfiler(profiled_app, trace_dir=str(tmp_path), sample_rate=0.0)
+
+        @profiled_app.route('/work')
+        def work():
+            with phase('parse'):
+                pass
+            with phase('score'):
+                sum(range(20000))
+            return 'ok'
+
+        with profiled_app.test_client() as profiled_client:
+            yield profiled_client, tmp_path
+
+    def test_phase_timings_recorded(self, profiled):
+        """test that phases appear in Server-Timing and timings.jsonl."""
+        profiled_client, trace_dir = profiled
+        response = profiled_client.get('/work')
+
+        assert response.headers['Server-Timing'].startswith('parse;dur=')
+        assert 'score;dur=' in response.headers['Server-Timing']
+        record = json.loads((trace_dir / 'timings.jsonl').read_text().splitlines()[-1])
+        assert set(record['phases']) == {'parse', 'score'}
+        assert record['trace'] is None
+
+    def test_header_triggers_cprofile_capture(self, profiled):
+        """test that X-Profile: cprofile writes a loadable pstats dump."""
+        profiled_client, trace_dir = profiled
+        profiled_client.get('/work', headers={'X-Profile': 'cprofile'})
+
+        dumps = list(trace_dir.glob('*.prof'))
+        assert len(dumps) == 1
+        assert pstats.Stats(str(dumps[0])).total_calls > 0
+
+    def test_header_triggers_folded_stacks(self, profiled):
+        """test that X-Profile: stack writes folded stacks."""
+        profiled_client, trace_dir = profiled
+        profiled_client.get('/work', headers={'X-Profile': 'stack'})
+
+        folded = list(trace_dir.glob('*.folded'))
+        assert len(folded) == 1
+        for line in folded[0].read_text().splitlines():
+            stack, count = line.rsplit(' ', 1)
+            assert int(count) > 0
+
+    def test_unknown_header_value_ignored(self, profiled):
+        """test that an unrecognized X-Profile value captures nothing."""
+        profiled_client, trace_dir = profiled
+        profiled_client.get('/work', headers={'X-Profile': 'yes please'})
+
+        assert not list(trace_dir.glob('*.prof')) + list(trace_dir.glob('*.folded'))
+        assert json.loads((trace_dir / 'timings.jsonl').read_text())['trace'] is None
+
+    def test_phase_is_noop_without_profiler(self, client):
+        """test that the service runs unchanged when profiling is off."""
+        response = client.get('/recommend?notes=vanilla')
+
+        assert response.status_code == 200
+        assert 'Server-Timing' not in response.headers
+
+
+class TestCompactResponses:
+    """tests for compressed, MessagePack and ids-only responses."""
+
+    def test_gzip_when_accepted(self, client):
+        """test that large responses are gzipped for clients that accept it."""
+        plain = client.get('/recommend?notes=vanilla&n=50')
+        response = client.get('/recommend?notes=vanilla&n=50', headers={'Accept-Encoding': 'gzip'})
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert len(response.data) < len(plain.data)
+        assert json.loads(gzip.decompress(response.data)) == plain.get_json()
+
+    def test_brotli_preferred(self, client):
+        """test that brotli is used when the client accepts it."""
+        brotli = pytest.importorskip('brotli')
+        response = client.get('/recommend?notes=vanilla&n=50', headers={'Accept-Encoding': 'gzip, br'})
+
+        assert response.headers['Content-Encoding'] == 'br'
+        assert isinstance(json.loads(brotli.decompress(response.data)), list)
+
+    def test_small_responses_not_compressed(self, client):
+        """test that responses under the size threshold are sent as is."""
+        response = client.get('/recommend?notes=vanilla&n=1', headers={'Accept-Encoding': 'gzip'})
+
+        assert 'Content-Encoding' not in response.headers
+        assert len(response.get_json()) == 1
+
+    def test_msgpack_when_accepted(self, client):
+        """test that MessagePack is returned for clients that ask for it."""
+        msgpack = pytest.importorskip('msgpack')
+        plain = client.get('/recommend?notes=rose')
+        response = client.get('/recommend?notes=rose', headers={'Accept': 'application/msgpack'})
+
+        assert response.content_type == 'application/msgpack'
+        assert msgpack.unpackb(response.data) == plain.get_json()
+
+    def test_msgpack_falls_back_to_json(self, client, monkeypatch):
+        """test that JSON is returned when msgpack is not installed."""
+        monkeypatch.setattr(negotiation, 'msgpack', None)
+        response = client.get('/recommend?notes=rose', headers={'Accept': 'application/msgpack'})
+
+        assert response.content_type == 'application/json'
+
+    def test_ids_format(self, client):
+        """test that format=ids returns catalog rows and scores in rank order."""
+        full = client.get('/recommend?notes=vanilla+musk&n=5').get_json()
+        data = client.get('/recommend?notes=vanilla+musk&n=5&format=ids').get_json()
+
+        assert len(data['ids']) == len(data['scores']) == 5
+        assert catalog.records(data['ids']) == full
+        assert data['scores'] == sorted(data['scores'], reverse=True)
+
+
+class TestCacheWarmUp:
+    """tests for the result cache, query log and startup warm-up."""
+
+    def test_normalize_query_keeps_vocabulary_terms(self):
+        """test that queries are reduced to sorted in-vocabulary terms."""
+        assert normalize_query(vectorizer, 'Vanilla  MUSK qzxv_42') == 'musk vanilla'
+
+    def test_repeat_query_served_from_cache(self, client):
+        """test that a repeated query is answered from the result cache."""
+        result_cache.clear()
+        first = client.get('/recommend?notes=vanilla+amber&n=4').get_json()
+        hits = result_cache.hits
+        second = client.get('/recommend?notes=amber+vanilla&n=4').get_json()
+
+        assert second == first
+        assert result_cache.hits == hits + 1
+
+    def test_queries_logged_normalized(self, client, tmp_path, monkeypatch):
+        """test that only normalized terms, n and catalog brand and note filters reach the log."""
+        log = QueryLog(str(tmp_path / 'queries.jsonl'))
+        monkeypatch.setattr(app_module, 'query_log', log)
+        favorite = catalog.name(7)
+        client.get(f'/recommend?notes=Rose+qzxv_42&n=3&exclude_brand=Montale&exclude_brand=qzxv_42'
+                   f'&exclude_note=Vanilla&exclude_name={favorite}')
+        log.close()
+
+        entry = json.loads((tmp_path / 'queries.jsonl').read_text())
+        assert entry == {'q': 'rose', 'n': 3, 'filters': {'exclude_brand': ['montale'], 'exclude_note': ['vanilla']}}
+        assert 'qzxv_42' not in (tmp_path / 'queries.jsonl').read_text()
+
+    def test_filter_case_shares_cache_entry(self, client):
+        """test that filters differing only in case and order share a cached result."""
+        result_cache.clear()
+        first = client.get('/recommend?notes=rose&n=3&exclude_brand=Dior&exclude_brand=Chanel').get_json()
+        hits = result_cache.hits
+        second = client.get('/recommend?notes=rose&n=3&exclude_brand=chanel&exclude_brand=DIOR').get_json()
+
+        assert second == first
+        assert result_cache.hits == hits + 1
+
+    def test_most_common_orders_by_frequency(self, tmp_path):
+        """test that the log replays the most frequent queries first."""
+        log = QueryLog(str(tmp_path / 'queries.jsonl'))
+        for q in ['rose', 'musk', 'rose', 'oud', 'rose', 'musk']:
+            log.record({'q': q, 'n': 5})
+        log.close()
+
+        assert [entry['q'] for entry in QueryLog(log.path).most_common(2)] == ['rose', 'musk']
+
+    def test_warm_up_fills_cache(self):
+        """test that warm-up scores logged queries into the cache."""
+        cache = ResultCache()
+        entries = [{'q': 'musk vanilla', 'n': 5}, {'q': 'rose', 'n': 3, 'filters': {'exclude_brand': ['Dior']}}]
+
+        warmed = warm_up(entries, vectorizer, snapshot.scorer, snapshot.filter_mask, cache)
+
+        assert warmed == 2
+        indices, _ = cache.get(result_key('rose', 3, {'exclude_brand': ['Dior']}))
+        assert all(catalog.brand(row) != 'Dior' for row in indices)
+
+    def test_health_waits_for_warm_up(self, client, monkeypatch):
+        """test that /health reports 503 until warm-up has finished."""
+        import threading
+        monkeypatch.setattr(app_module, 'ready', threading.Event())
+
+        assert client.get('/health').status_code == 503
+        app_module.ready.set()
+        assert client.get('/health').status_code == 200
+
+
+class TestHotReload:
+    """tests for snapshot swaps on index reload."""
+
+    @pytest.fixture
+    def catalog_csv(self, tmp_path):
+        """a small catalog CSV the tests can rewrite."""
+        path = tmp_path / 'catalog.csv'
+        frame = pd.read_csv('perfumeData.csv', encoding='ISO-8859-1').dropna().drop_duplicates()
+        frame.head(40).to_csv(path, index=False, encoding='ISO-8859-1')
+        return path, frame
+
+    def test_reload_swaps_snapshot(self, catalog_csv):
+        """test that a reload builds a new version from the changed catalog."""
+        from snapshot import IndexManager
+        path, frame = catalog_csv
+        manager = IndexManager(str(path))
+
+        frame.head(60).to_csv(path, index=False, encoding='ISO-8859-1')
+        snapshot = manager.reload()
+
+        assert manager.current is snapshot
+        assert snapshot.version == 2
+        assert len(snapshot.catalog) == 60
+
+    def test_reader_keeps_pinned_snapshot(self, catalog_csv):
+        """test that an in-flight reader keeps its snapshot and it is freed afterwards."""
+        import gc
+        from snapshot import IndexManager
+        path, frame = catalog_csv
+        manager = IndexManager(str(path))
+
+        pinned = manager.current
+        query = pinned.vectorizer.transform(['vanilla'])
+        frame.head(60).to_csv(path, index=False, encoding='ISO-8859-1')
+        manager.reload()
+
+        assert len(pinned.catalog) == 40
+        indices, _ = pinned.scorer.top_k(query, 5)
+        assert indices.max() < 40
+        assert manager.live_snapshots == 2
+
+        del pinned
+        gc.collect()
+        assert manager.live_snapshots == 1
+
+    def test_snapshot_prepared_before_going_live(self, catalog_csv):
+        """test that a rebuilt snapshot is warmed before readers can see it."""
+        from snapshot import IndexManager
+        path, _ = catalog_csv
+        seen = []
+
+        def prepare(snapshot):
+            seen.append(manager.current is snapshot)
+            snapshot.warm([{'q': 'vanilla', 'n': 3}])
+
+        manager = IndexManager(str(path), prepare=prepare)
+        snapshot = manager.reload()
+
+        assert seen == [False]
+        assert len(snapshot.results) == 1
+
+    def test_failed_reload_keeps_serving(self, catalog_csv):
+        """test that a broken catalog leaves the current snapshot in place."""
+        from snapshot import IndexManager
+        path, _ = catalog_csv
+        manager = IndexManager(str(path))
+        current = manager.current
+
+        path.write_text('not,a,catalog\n')
+        manager._reload_logged()
+
+        assert manager.current is current
+        assert not manager._reload_lock.locked()
+
+    def test_endpoints_report_version(self, client, catalog_csv, monkeypatch):
+        """test that responses carry the index version and /reload swaps it."""
+        import time
+        from snapshot import IndexManager
+        path, _ = catalog_csv
+        monkeypatch.setattr(app_module, 'index', IndexManager(str(path)))
+
+        assert client.get('/recommend?notes=vanilla').headers['X-Index-Version'] == '1'
+        assert client.post('/reload').status_code == 202
+
+        deadline = time.monotonic() + 10
+        while app_module.index.current.version == 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert client.get('/recommend?notes=vanilla').headers['X-Index-Version'] == '2'
+
+
+class TestFieldWeights:
+    """tests for per-field TF-IDF and query-time field weights."""
+
+    @pytest.fixture
+    def frame(self):
+        """the cleaned catalog frame."""
+        return pd.read_csv('perfumeData.csv', encoding='ISO-8859-1').dropna().drop_duplicates()
+
+    def test_transform_matches_per_field_tfidf(self, frame):
+        """test that the fused query vector equals the per-field sklearn vectors side by side."""
+        fields = FieldVectorizer.fit(frame, weights={'Name': 1, 'Brand': 1, 'Notes': 1})[0]
+        queries = ['vanilla musk', 'chanel rose', 'qzxv_42']
+
+        fused = fields.transform(queries).toarray()
+        expected = np.hstack([v.transform(queries).toarray() for v in fields.vectorizers.values()])
+
+        assert np.allclose(fused, expected, atol=1e-6)
+
+    def test_scores_are_weighted_field_cosines(self, frame):
+        """test that one product scores the weighted sum of per-field cosine similarities."""
+        weights = {'Name': 0.5, 'Brand': 0.3, 'Notes': 1.0}
+        fields, stacked = FieldVectorizer.fit(frame, weights=weights)
+        query = 'rose oud'
+
+        scores = (stacked @ fields.transform([query]).T).toarray().ravel()
+
+        expected = sum(
+            weights[field] * cosine_similarity(
+                TfidfVectorizer().fit(frame[field].values.astype('U')).transform(frame[field].values.astype('U')),
+                fields.vectorizers[field].transform([query]),
+            ).ravel()
+            for field in fields.fields
+        )
+        assert np.allclose(scores, expected, atol=1e-5)
+
+    def test_brand_only_weights(self, client):
+        """test that zeroing name and notes weights ranks by brand alone."""
+        brand = catalog.brand(0)
+        response = client.get(f'/recommend?notes={brand}&n=3&name_weight=0&notes_weight=0')
+
+        assert response.status_code == 200
+        assert all(r['Brand'] == brand for r in response.get_json())
+
+    def test_weights_change_cache_key(self, client):
+        """test that the same query under different weights is cached separately."""
+        result_cache.clear()
+        client.get('/recommend?notes=rose&n=3')
+        client.get('/recommend?notes=rose&n=3&notes_weight=2')
+
+        assert len(result_cache) == 2
+
+    @pytest.mark.parametrize('weight', ['-1', 'heavy', 'nan', 'inf', '-inf'])
+    def test_invalid_weights_rejected(self, client, weight):
+        """test that negative, non-numeric and non-finite weights are client errors and never cached."""
+        size = len(result_cache)
+
+        response = client.get(f'/recommend?notes=rose&notes_weight={weight}')
+        favorites = client.get(f'/recommend/favorites?favorite={catalog.name(7)}&brand_weight={weight}')
+
+        assert response.status_code == favorites.status_code == 400
+        assert 'error' in response.get_json()
+        assert len(result_cache) == size
+
+    def test_unknown_field_rejected(self):
+        """test that weights for fields the vectorizer does not have are refused."""
+        with pytest.raises(ValueError):
+            vectorizer.transform(['rose'], {'Accords': 1.0})
@@ -0,0 +1,124 @@
+"""Prefix index for search-box typeahead.
+
+Perfume names, brands and the Notes field vocabulary are lowercased into
+one sorted key list, packed with the display texts into UTF-8 buffers like
+the catalog's names. A prefix query is two bisections into that list plus a
+partial sort of the matching slice by a precomputed rank (most frequent
+first). Completions for one- and two-character prefixes, whose slices are
+the widest, are computed once at build time.
+
+Queries never touch pandas or the TF-IDF matrix.
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+
+from catalog import PackedStrings, object_nbytes
+from facets import name_key
+
+MAX_COMPLETIONS = 20
+PRECOMPUTED_PREFIX_LEN = 2
+
+KINDS = ('name', 'brand', 'note')
+
+
+class PrefixIndex:
+    """Frequency-ranked prefix completions over names, brands and notes."""
+
+    def __init__(self, entries):
+        """entries is an iterable of (text, kind, count)."""
+        merged = {}
+        for text, kind, count in entries:
+            key = name_key(text)
+            if not key:
+                continue
+            slot = (key, kind)
+            if slot in merged:
+                merged[slot][1] += count
+            else:
+                merged[slot] = [text, count]
+
+        items = sorted(merged.items())
+        keys = [key for (key, _), _ in items]
+        self.keys = PackedStrings(keys)
+        self.texts = PackedStrings([text for _, (text, _) in items])
+        self.kinds = np.array([KINDS.index(kind) for (_, kind), _ in items], dtype=np.int8)
+        counts = [count for _, (_, count) in items]
+        self.counts = np.array(counts, dtype=np.int64)
+
+        # rank 0 is the best completion: most frequent, then shortest, then alphabetical
+        order = sorted(range(len(items)),
+                       key=lambda i: (-counts[i], len(keys[i]), keys[i]))
+        self.ranks = np.empty(len(items), dtype=np.int64)
+        self.ranks[order] = np.arange(len(items))
+
+        self._precomputed = {}
+        for prefix in {key[:size] for key in keys
+                       for size in range(1, PRECOMPUTED_PREFIX_LEN + 1)}:
+            self._precomputed[prefix] = np.array(self._search(prefix, MAX_COMPLETIONS), dtype=np.int32)
+
+    @classmethod
+    def from_catalog(cls, catalog, vectorizer, feature_vectors):
+        """Build the index from catalog names and brands plus the Notes vocabulary.
+
+        Counts are rows per name, rows per brand and document frequency per note term.
+        """
+        def entries():
+            for row in range(len(catalog)):
+                yield catalog.name(row), 'name', 1
+
+            brand_counts = np.bincount(catalog.brand_codes, minlength=len(catalog.brands))
+            for brand, count in zip(catalog.brands, brand_counts.tolist()):
+                yield brand, 'brand', count
+
+            doc_freq = np.bincount(feature_vectors.indices, minlength=vectorizer.n_features)
+            offset = vectorizer.offsets['Notes']
+            for term, column in vectorizer.vectorizers['Notes'].vocabulary_.items():
+                yield term, 'note', int(doc_freq[offset + column])
+
+        return cls(entries())
+
+    def _search(self, prefix, n):
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + '\uffff', lo)
+        if hi - lo > n:
+            ranks = self.ranks[lo:hi]
+            best = np.argpartition(ranks, n)[:n]
+            ids = lo + best[np.argsort(ranks[best])]
+        else:
+            ids = lo + np.argsort(self.ranks[lo:hi])
+        return ids
+
+    def complete(self, prefix, n=8):
+        """Return up to n completions for the prefix, best first."""
+        prefix = name_key(prefix)
+        n = max(0, min(n, MAX_COMPLETIONS))
+        if not prefix or not n:
+            return []
+
+        ids = self._precomputed.get(prefix)
+        if ids is None:
+            if len(prefix) > PRECOMPUTED_PREFIX_LEN:
+                ids = self._search(prefix, n)
+            else:
+                ids = np.empty(0, dtype=np.intp)
+
+        return [
+            {'text': self.texts[i], 'type': KINDS[self.kinds[i]], 'count': int(self.counts[i])}
+            for i in ids[:n].tolist()
+        ]
+
+    def memory_usage(self):
+        """Bytes held by the packed keys and texts, the per-entry arrays and the precomputed prefixes."""
+        return {
+            'keys': self.keys.nbytes,
+            'texts': self.texts.nbytes,
+            'kinds': int(self.kinds.nbytes),
+            'counts': int(self.counts.nbytes),
+            'ranks': int(self.ranks.nbytes),
+            'precomputed': object_nbytes(self._precomputed),
+        }
+
+    def __len__(self):
+        return len(self.keys)
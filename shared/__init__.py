@@ -0,0 +1,5 @@
+"""Modules shared by the recSystem and deepResearch Flask services.
+
+Both services put the repository root on sys.path and import these as
+`shared.<module>`, so each lives in exactly one place.
+"""
@@ -0,0 +1,96 @@
+"""Content negotiation for the Flask services' responses.
+
+Handlers return `respond(payload)` instead of `jsonify(payload)`. Clients
+that send `Accept: application/msgpack` get MessagePack, everyone else gets
+JSON. `CompactResponses` then compresses any response over
+COMPRESS_MIN_BYTES with brotli or gzip, whichever the client's
+Accept-Encoding prefers.
+
+msgpack and brotli are optional: without them responses fall back to JSON
+and gzip.
+"""
+
+import gzip
+import os
+
+from flask import current_app, jsonify, request
+
+from .profiling import phase
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+JSON_TYPE = 'application/json'
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+# fast settings, these responses are built per request
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def wants_msgpack():
+    """Whether the client prefers MessagePack over JSON and we can produce it."""
+    if msgpack is None:
+        return False
+    return request.accept_mimetypes.best_match((JSON_TYPE,) + MSGPACK_TYPES) in MSGPACK_TYPES
+
+
+def respond(payload):
+    """Serialize a payload as MessagePack or JSON, whichever the client accepts."""
+    if not wants_msgpack():
+        response = jsonify(payload)
+    else:
+        response = current_app.response_class(
+            msgpack.packb(payload, use_bin_type=True), mimetype=MSGPACK_TYPES[0]
+        )
+    response.vary.add('Accept')
+    return response
+
+
+def _encoding():
+    """Pick the response encoding from the client's Accept-Encoding."""
+    offered = ('br', 'gzip') if brotli is not None else ('gzip',)
+    return request.accept_encodings.best_match(offered)
+
+
+class CompactResponses:
+    """Flask extension that compresses responses the client can decode."""
+
+    def __init__(self, app=None, min_size=COMPRESS_MIN_BYTES):
+        self.min_size = min_size
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self._compress)
+
+    def _compress(self, response):
+        if (response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or not 200 <= response.status_code < 300 or response.status_code == 204):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = _encoding()
+        body = response.get_data()
+        if encoding is None or len(body) < self.min_size:
+            return response
+
+        with phase('compress'):
+            if encoding == 'br':
+                body = brotli.compress(body, quality=BROTLI_QUALITY)
+            else:
+                body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,177 @@
+"""Opt-in request profiling for the Flask services.
+
+When enabled (PROFILE_REQUESTS=1) every request is timed, broken down by
+the phases a handler marks with `phase()`. Timings are returned in a
+Server-Timing header and appended to timings.jsonl in the trace directory.
+
+A request can also be captured in full, either by sending the X-Profile
+header (`stack` or `cprofile`) or by random sampling at PROFILE_SAMPLE_RATE:
+
+- stack: a background thread samples the request thread's stack and writes
+  folded stacks (`a;b;c 12`), readable by flamegraph.pl, speedscope and
+  inferno
+- cprofile: a pstats dump, readable by snakeviz, flameprof and gprof2dot
+"""
+
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'stack')
+PROFILE_TRACE_DIR = os.getenv('PROFILE_TRACE_DIR', 'traces')
+
+PROFILE_HEADER = 'X-Profile'
+CAPTURE_MODES = ('stack', 'cprofile')
+STACK_INTERVAL = 0.001
+
+
+@contextmanager
+def phase(name):
+    """Time a block of a request handler; a no-op when profiling is off."""
+    timings = g.get('phase_timings') if has_request_context() else None
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append((name, (time.perf_counter() - start) * 1000))
+
+
+class StackSampler:
+    """Samples one thread's Python stack on an interval into folded stacks."""
+
+    def __init__(self, thread_id, interval=STACK_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.counts.items())
+
+
+class RequestProfiler:
+    """Flask extension that records per-phase timings and sampled captures."""
+
+    def __init__(self, app=None, trace_dir=PROFILE_TRACE_DIR,
+                 sample_rate=PROFILE_SAMPLE_RATE, mode=PROFILE_MODE):
+        self.trace_dir = trace_dir
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self._write_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        os.makedirs(self.trace_dir, exist_ok=True)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    def _capture_mode(self):
+        """Pick a capture mode from the request header or the sample rate."""
+        requested = request.headers.get(PROFILE_HEADER, '').lower()
+        if requested in CAPTURE_MODES:
+            return requested
+        # any other header value is ignored, so clients cannot force traces to disk
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.mode
+        return None
+
+    def _start(self):
+        g.phase_timings = []
+        g.profile_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        g.profile_capture = None
+
+        mode = self._capture_mode()
+        if mode == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+            g.profile_capture = (mode, profile)
+        elif mode == 'stack':
+            sampler = StackSampler(threading.get_ident())
+            sampler.start()
+            g.profile_capture = (mode, sampler)
+
+        g.profile_start = time.perf_counter()
+
+    def _stop_capture(self):
+        """Stop an active capture and write it to the trace directory."""
+        capture = g.pop('profile_capture', None)
+        if capture is None:
+            return None
+
+        mode, profiler = capture
+        name = f"{g.profile_id}-{request.endpoint or 'unknown'}"
+        if mode == 'cprofile':
+            profiler.disable()
+            path = os.path.join(self.trace_dir, f"{name}.prof")
+            profiler.dump_stats(path)
+        else:
+            profiler.stop()
+            path = os.path.join(self.trace_dir, f"{name}.folded")
+            with open(path, 'w') as f:
+                f.write(profiler.folded())
+        return path
+
+    def _finish(self, response):
+        total_ms = (time.perf_counter() - g.profile_start) * 1000
+        trace_path = self._stop_capture()
+
+        timings = g.phase_timings + [('total', total_ms)]
+        response.headers['Server-Timing'] = ', '.join(
+            f"{name};dur={ms:.3f}" for name, ms in timings
+        )
+
+        record = {
+            'id': g.profile_id,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 3),
+            'phases': {name: round(ms, 3) for name, ms in g.phase_timings},
+            'trace': trace_path,
+        }
+        with self._write_lock:
+            with open(os.path.join(self.trace_dir, 'timings.jsonl'), 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+        return response
+
+    def _teardown(self, exc):
+        # after_request is skipped on unhandled errors, so never leave a capture running
+        if g.get('profile_capture') is not None:
+            self._stop_capture()
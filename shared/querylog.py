@@ -0,0 +1,72 @@
+"""Append-only log of normalized queries, replayed to warm caches at startup.
+
+Callers record already-anonymized records (normalized query terms, never
+raw input or user identifiers) as JSON lines. At startup the most frequent
+records in the recent tail of the log are replayed into the caches before
+the service reports ready on /health.
+
+Logging is off unless QUERY_LOG_PATH is set.
+"""
+
+import json
+import os
+import threading
+from collections import Counter, deque
+
+QUERY_LOG_PATH = os.getenv('QUERY_LOG_PATH', '')
+WARMUP_QUERIES = int(os.getenv('WARMUP_QUERIES', '200'))
+
+# only the most recent records count towards what gets replayed
+REPLAY_WINDOW = 100_000
+
+
+class QueryLog:
+    """Thread-safe JSON-lines query log."""
+
+    def __init__(self, path=QUERY_LOG_PATH, window=REPLAY_WINDOW):
+        self.path = path
+        self.window = window
+        self._lock = threading.Lock()
+        self._file = None
+
+    def record(self, entry):
+        """Append one record; a no-op when logging is off."""
+        if not self.path:
+            return
+        line = json.dumps(entry, sort_keys=True, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+
+    def most_common(self, n, key=None):
+        """The latest record for each of the n most frequent keys, most frequent first.
+
+        Records are grouped by the `key` field, or by their whole content when
+        key is None.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return []
+
+        counts = Counter()
+        latest = {}
+        with open(self.path, encoding='utf-8') as f:
+            for line in deque(f, maxlen=self.window):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line torn by a crash mid-write
+                    continue
+                group = entry.get(key) if key else line.strip()
+                counts[group] += 1
+                latest[group] = entry
+
+        return [latest[group] for group, _ in counts.most_common(n)]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None